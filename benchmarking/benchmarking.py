@@ -0,0 +1,206 @@
+"""Benchmarks for the OT2 simulation.
+
+Run from the root of the repository so the simulation can find its URDFs and textures:
+
+    python -m benchmarking.benchmarking droplets --drops 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+# The simulation loads its assets relative to the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+def print_table(columns, rows):
+    widths = [max(len(str(column)), *(len(str(row[i])) for row in rows)) for i, column in enumerate(columns)]
+    print("  ".join(str(column).rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+
+def benchmark_droplets(args):
+    """Dispenses a droplet every step and reports the step time per window of drops.
+
+    Landed droplets are retired from the physics world, so the step time should stay flat however many droplets
+    have been dispensed.
+    """
+    import pybullet as p
+    from sim_class import Simulation
+
+    sim = Simulation(num_agents=1, render=False)
+    robotId = sim.robotIds[0]
+    specimenId = sim.specimenIds[0]
+
+    # Move the pipette over the middle of the specimen so the droplets land on it
+    specimen_position = p.getBasePositionAndOrientation(specimenId)[0]
+    pipette_position = sim.get_pipette_position(robotId)
+    p.resetJointState(robotId, 0, targetValue=pipette_position[0] - specimen_position[0])
+    p.resetJointState(robotId, 1, targetValue=pipette_position[1] - specimen_position[1])
+
+    drop = [[0, 0, 0, 1]]
+    rows = []
+    for window in range(args.drops // args.window):
+        start = time.perf_counter()
+        for _ in range(args.window):
+            sim.run(drop)
+        step_time = (time.perf_counter() - start) / args.window
+        landed = sum(len(positions) for positions in sim.droplet_positions.values())
+        rows.append([(window + 1) * args.window, landed, len(sim.sphereIds), p.getNumBodies(), f"{step_time * 1e6:.1f}"])
+
+    sim.close()
+    print_table(["drops", "landed", "in flight", "bodies", "step time (us)"], rows)
+    first, last = float(rows[0][-1]), float(rows[-1][-1])
+    print(f"step time after {rows[-1][0]} drops is {last / first:.2f}x the step time of the first {args.window}")
+
+
+def benchmark_rewards(args):
+    """Times every registered reward over batches of agents, batched against one call per agent."""
+    import numpy as np
+    from rewards import REWARDS
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for name, reward_fn in sorted(REWARDS.items()):
+        for n in args.agents:
+            observations = rng.uniform(-0.2, 0.3, size=(n, 6)).astype(np.float32)
+            previous_observations = rng.uniform(-0.2, 0.3, size=(n, 6)).astype(np.float32)
+            joint_torques = rng.uniform(-800, 800, size=(n, 3)).astype(np.float32)
+            joint_velocities = rng.uniform(-1, 1, size=(n, 3)).astype(np.float32)
+
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                reward_fn(observations, previous_observations, joint_torques, joint_velocities, 0.01)
+            batched = (time.perf_counter() - start) / args.repeats
+
+            start = time.perf_counter()
+            for _ in range(max(1, args.repeats // n)):
+                for i in range(n):
+                    reward_fn(observations[i:i + 1], previous_observations[i:i + 1], joint_torques[i:i + 1], joint_velocities[i:i + 1], 0.01)
+            looped = (time.perf_counter() - start) / max(1, args.repeats // n)
+
+            rows.append([name, n, f"{batched * 1e6:.1f}", f"{batched / n * 1e9:.0f}", f"{looped / batched:.1f}x"])
+
+    print_table(["reward", "agents", "batch (us)", "per agent (ns)", "speedup vs loop"], rows)
+
+
+def benchmark_spawn(args):
+    """Time until a vectorized env is reset and ready, building the scene per worker against forking it."""
+    from stable_baselines3.common.env_util import make_vec_env
+    from stable_baselines3.common.vec_env import SubprocVecEnv
+    from ot2_gym_wrapper import OT2_wrapper
+    from worker_pool import make_prefork_vec_env, worker_memory
+
+    builders = {
+        "per worker": lambda n: make_vec_env(OT2_wrapper, n_envs=n, vec_env_cls=SubprocVecEnv),
+        "pre-forked": lambda n: make_prefork_vec_env(n),
+    }
+    rows = []
+    for n in args.workers:
+        for name, build in builders.items():
+            start = time.perf_counter()
+            vec_env = build(n)
+            vec_env.reset()
+            elapsed = time.perf_counter() - start
+            memory = worker_memory(vec_env)
+            vec_env.close()
+            rss = sum(rss for rss, pss in memory) / n
+            pss = sum(pss or 0 for rss, pss in memory) / n
+            rows.append([name, n, f"{elapsed:.2f}", f"{rss:.0f}", f"{pss:.0f}"])
+
+    print_table(["pool", "workers", "ready (s)", "rss/worker (MB)", "pss/worker (MB)"], rows)
+
+
+def benchmark_scaling(args):
+    """Steps per second against the number of agents in one world, written to a CSV as the scaling curve."""
+    import csv
+    import random
+    from sim_class import Simulation
+
+    rows = []
+    base = None
+    for n in args.agents:
+        sim = Simulation(num_agents=n, render=False, large_scale=args.large_scale)
+        actions = [[random.uniform(-1, 1) for _ in range(3)] + [0] for _ in range(n)]
+        # Let the robots start moving before timing
+        sim.run(actions, num_steps=10)
+
+        start = time.perf_counter()
+        sim.run(actions, num_steps=args.steps)
+        steps_per_second = args.steps / (time.perf_counter() - start)
+        sim.close()
+
+        agent_steps_per_second = steps_per_second * n
+        base = base or agent_steps_per_second
+        # Efficiency 1.0 means the cost of a step grew linearly with the number of agents, so agent steps per second stayed the same
+        rows.append([n, f"{steps_per_second:.1f}", f"{agent_steps_per_second:.0f}", f"{agent_steps_per_second / base:.2f}"])
+
+    columns = ["agents", "steps/s", "agent steps/s", "efficiency"]
+    print_table(columns, rows)
+    with open(args.output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    print(f"Scaling curve written to {args.output}")
+
+
+def benchmark_idle(args):
+    """Step time with a growing share of idle agents, with and without putting idle agents to sleep."""
+    import random
+    from sim_class import Simulation
+
+    rows = []
+    for active in args.active:
+        times = []
+        for sleep_idle_agents in [False, True]:
+            sim = Simulation(num_agents=args.agents, render=False, large_scale=True, sleep_idle_agents=sleep_idle_agents)
+            actions = [[random.uniform(-1, 1) for _ in range(3)] + [0] if i < active else [0, 0, 0, 0] for i in range(args.agents)]
+            # Give the idle agents time to settle and fall asleep
+            sim.run(actions, num_steps=50)
+
+            start = time.perf_counter()
+            sim.run(actions, num_steps=args.steps)
+            times.append((time.perf_counter() - start) / args.steps)
+            sleeping = len(sim.sleeping)
+            sim.close()
+        rows.append([args.agents, active, sleeping, f"{times[0] * 1e3:.2f}", f"{times[1] * 1e3:.2f}", f"{times[0] / times[1]:.2f}x"])
+
+    print_table(["agents", "active", "sleeping", "awake step (ms)", "sleep step (ms)", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    droplets = subparsers.add_parser("droplets", help="step time while dispensing droplets")
+    droplets.add_argument("--drops", type=int, default=10000)
+    droplets.add_argument("--window", type=int, default=1000)
+    droplets.set_defaults(func=benchmark_droplets)
+
+    rewards = subparsers.add_parser("rewards", help="micro-benchmark of the registered reward functions")
+    rewards.add_argument("--agents", type=int, nargs="+", default=[1, 16, 256, 4096])
+    rewards.add_argument("--repeats", type=int, default=1000)
+    rewards.set_defaults(func=benchmark_rewards)
+
+    spawn = subparsers.add_parser("spawn", help="start up time and memory of the env worker pools")
+    spawn.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    spawn.set_defaults(func=benchmark_spawn)
+
+    scaling = subparsers.add_parser("scaling", help="steps per second against the number of agents")
+    scaling.add_argument("--agents", type=int, nargs="+", default=[1, 4, 16, 64, 256])
+    scaling.add_argument("--steps", type=int, default=200)
+    scaling.add_argument("--large_scale", action=argparse.BooleanOptionalAction, default=True)
+    scaling.add_argument("--output", type=str, default="benchmarking/scaling.csv")
+    scaling.set_defaults(func=benchmark_scaling)
+
+    idle = subparsers.add_parser("idle", help="step time with idle agents put to sleep")
+    idle.add_argument("--agents", type=int, default=64)
+    idle.add_argument("--active", type=int, nargs="+", default=[64, 32, 16, 4, 0])
+    idle.add_argument("--steps", type=int, default=200)
+    idle.set_defaults(func=benchmark_idle)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,169 @@
+import collections
+import copy
+import io
+import os
+import queue
+import shutil
+import threading
+import zipfile
+
+import numpy as np
+import torch as th
+import stable_baselines3 as sb3
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.save_util import data_to_json
+from stable_baselines3.common.utils import get_system_info
+
+
+def _copy_tensors(obj):
+    """Recursively copies every tensor in a (nested) state dict to the cpu so it no longer shares memory with the model."""
+    if isinstance(obj, th.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, _copy_tensors(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_copy_tensors(value) for value in obj)
+    return obj
+
+
+def snapshot_model(model):
+    """Takes an in-memory snapshot of everything BaseAlgorithm.save would write.
+
+    This is the only part of a checkpoint that runs on the training thread. It copies the parameters and
+    optimizer state and the mutable buffers of the model, the slow serialization is left to write_checkpoint.
+
+    Returns:
+        dict: The data, params and pytorch_variables of the model at this point in training.
+    """
+    data = model.__dict__.copy()
+    exclude = set(model._excluded_save_params())
+    state_dicts_names, torch_variable_names = model._get_torch_save_params()
+    for torch_var in state_dicts_names + torch_variable_names:
+        exclude.add(torch_var.split(".")[0])
+    for param_name in exclude:
+        data.pop(param_name, None)
+
+    # The rollout buffers and last observations keep changing while the writer works on the snapshot
+    for key, value in data.items():
+        if isinstance(value, (np.ndarray, collections.deque)):
+            data[key] = copy.copy(value)
+
+    pytorch_variables = {}
+    for name in torch_variable_names:
+        attr = model
+        for part in name.split("."):
+            attr = getattr(attr, part)
+        pytorch_variables[name] = _copy_tensors(attr)
+
+    return {
+        "data": data,
+        "params": _copy_tensors(model.get_parameters()),
+        "pytorch_variables": pytorch_variables,
+    }
+
+
+def write_checkpoint(snapshot, path):
+    """Serializes a snapshot to a compressed zip that PPO.load can read, written atomically.
+
+    The archive is built in memory and written next to path first, so a crash never leaves a half written model.zip.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("data", data_to_json(snapshot["data"]))
+        with archive.open("pytorch_variables.pth", mode="w", force_zip64=True) as f:
+            th.save(snapshot["pytorch_variables"], f)
+        for file_name, state_dict in snapshot["params"].items():
+            with archive.open(file_name + ".pth", mode="w", force_zip64=True) as f:
+                th.save(state_dict, f)
+        archive.writestr("_stable_baselines3_version", sb3.__version__)
+        archive.writestr("system_info.txt", get_system_info(print_info=False)[1])
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buffer.getbuffer())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointCallback(BaseCallback):
+    """Saves the model every save_freq steps without stalling rollout collection.
+
+    The policy and optimizer state are snapshotted in memory on the training thread, serializing, compressing and
+    writing happens on a background thread. The last keep_last checkpoints are kept in save_path as
+    checkpoint_<timesteps>.zip, together with best_model.zip for the best score seen so far.
+
+    The score is the mean reward of eval_callback when one is given (an EvalCallback in the same callback list),
+    otherwise the mean reward of the recent training episodes.
+    """
+    def __init__(self, save_freq, save_path, keep_last=3, eval_callback=None, max_pending=2, verbose=0):
+        super(AsyncCheckpointCallback, self).__init__(verbose)
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.keep_last = keep_last
+        self.eval_callback = eval_callback
+        self.best_score = -np.inf
+        self.checkpoints = []
+        # Bounded so a slow disk blocks training instead of piling up snapshots in memory
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.writer = None
+        self.error = None
+
+    def _init_callback(self) -> None:
+        os.makedirs(self.save_path, exist_ok=True)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _score(self):
+        if self.eval_callback is not None:
+            return self.eval_callback.last_mean_reward
+        if len(self.model.ep_info_buffer) == 0:
+            return None
+        return float(np.mean([info["r"] for info in self.model.ep_info_buffer]))
+
+    def _on_step(self) -> bool:
+        if self.error is not None:
+            raise RuntimeError(f"Checkpoint writer failed: {self.error}")
+
+        if self.n_calls % self.save_freq == 0:
+            score = self._score()
+            is_best = score is not None and score > self.best_score
+            if is_best:
+                self.best_score = score
+            self.pending.put((self.num_timesteps, is_best, snapshot_model(self.model)))
+        return True
+
+    def _on_training_end(self) -> None:
+        # Wait for the writer so the last checkpoint is on disk when learn returns
+        self.pending.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise RuntimeError(f"Checkpoint writer failed: {self.error}")
+
+    def _write_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            # After a failed write the loop keeps draining the queue, so a put on the training thread never blocks
+            # forever; the error is raised there on the next step
+            if self.error is not None:
+                continue
+            num_timesteps, is_best, snapshot = item
+            try:
+                path = os.path.join(self.save_path, f"checkpoint_{num_timesteps}.zip")
+                write_checkpoint(snapshot, path)
+                self.checkpoints.append(path)
+                if is_best:
+                    best_path = os.path.join(self.save_path, "best_model.zip")
+                    shutil.copyfile(path, best_path + ".tmp")
+                    os.replace(best_path + ".tmp", best_path)
+
+                # Remove the oldest checkpoints once there are more than keep_last
+                while len(self.checkpoints) > self.keep_last:
+                    os.remove(self.checkpoints.pop(0))
+
+                if self.verbose > 0:
+                    print(f"Saved checkpoint {path}" + (" (best)" if is_best else ""))
+            except Exception as e:
+                self.error = e
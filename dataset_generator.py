@@ -0,0 +1,117 @@
+"""Parallel synthetic dataset generator for plate vision.
+
+Every worker process runs its own headless Simulation and renders scenes with a random plate texture, a random
+pattern of landed droplets and a random pipette pose. The images are written together with the exact world
+coordinates of the pipette and the droplets to sharded .npz files:
+
+    python dataset_generator.py --samples 200000 --workers 16 --output datasets/plates
+
+Each shard holds
+    images (B, H, W, 3) uint8       the rendered frames
+    pipette (B, 3)                  pipette tip world coordinates
+    droplets (B, max_droplets, 3)   droplet world coordinates, padded with NaN
+    num_droplets (B,)               number of droplets in each image
+    texture (B,)                    index of the plate texture in textures
+    view_matrix, projection_matrix  (B, 16) camera matrices, to project the world coordinates to pixels
+"""
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+
+def generate_shards(worker, num_samples, args):
+    """Renders num_samples scenes in this process and writes them in shards of args.shard_size.
+
+    Returns:
+        int: The number of images written.
+    """
+    import pybullet as p
+    from sim_class import Simulation, ENVELOPE_LOW, ENVELOPE_HIGH
+
+    rng = np.random.default_rng(args.seed + worker)
+    sim = Simulation(num_agents=1, render=False)
+    robotId, specimenId = sim.robotIds[0], sim.specimenIds[0]
+
+    # Load every plate texture once, the scenes only switch between them
+    texture_names = sorted(name for name in os.listdir("textures") if name.endswith(".png"))
+    textureIds = [p.loadTexture(f"textures/{name}") for name in texture_names]
+
+    specimen_position = np.array(p.getBasePositionAndOrientation(specimenId)[0])
+    # Droplets lie on the top of the 0.15 x 0.15 x 0.015 specimen, kept away from its edges
+    droplet_z = specimen_position[2] + 0.0075 + sim.droplet_radius
+    projection_matrix = p.computeProjectionMatrixFOV(args.fov, args.width / args.height, 0.01, 10.0)
+
+    written = 0
+    shard = 0
+    while written < num_samples:
+        batch = min(args.shard_size, num_samples - written)
+        images = np.zeros((batch, args.height, args.width, 3), dtype=np.uint8)
+        pipette = np.zeros((batch, 3), dtype=np.float32)
+        droplets = np.full((batch, args.max_droplets, 3), np.nan, dtype=np.float32)
+        num_droplets = np.zeros(batch, dtype=np.int32)
+        texture = np.zeros(batch, dtype=np.int32)
+        view_matrices = np.zeros((batch, 16), dtype=np.float32)
+
+        for i in range(batch):
+            # Clear the droplets of the previous scene and move the pipette to a random pose
+            sim.reset_agents([0], start_positions=[rng.uniform(ENVELOPE_LOW, ENVELOPE_HIGH)])
+
+            texture[i] = rng.integers(len(textureIds))
+            p.changeVisualShape(specimenId, -1, textureUniqueId=textureIds[texture[i]])
+
+            num_droplets[i] = rng.integers(0, args.max_droplets + 1)
+            for j in range(num_droplets[i]):
+                position = [*(specimen_position[:2] + rng.uniform(-0.06, 0.06, size=2)), droplet_z]
+                sim.add_droplet_visual(robotId, position)
+                droplets[i, j] = position
+
+            # Look at the specimen from above with a small random jitter of the camera
+            camera_position = specimen_position + [0.25, 0, 0.3] + rng.uniform(-0.03, 0.03, size=3)
+            view_matrix = p.computeViewMatrix(camera_position.tolist(), specimen_position.tolist(), [0, 0, 1])
+            _, _, rgba, _, _ = p.getCameraImage(args.width, args.height, viewMatrix=view_matrix, projectionMatrix=projection_matrix)
+
+            images[i] = np.reshape(rgba, (args.height, args.width, 4))[:, :, :3]
+            pipette[i] = sim.get_pipette_position(robotId)
+            view_matrices[i] = view_matrix
+
+        np.savez(os.path.join(args.output, f"shard-{worker:03d}-{shard:05d}.npz"),
+                 images=images, pipette=pipette, droplets=droplets, num_droplets=num_droplets, texture=texture,
+                 view_matrix=view_matrices, projection_matrix=np.tile(np.array(projection_matrix, dtype=np.float32), (batch, 1)))
+        written += batch
+        shard += 1
+
+    sim.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", type=str, default="datasets/plates")
+    parser.add_argument("--shard_size", type=int, default=1000)
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--fov", type=float, default=50)
+    parser.add_argument("--max_droplets", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    # Split the samples as evenly as possible over the workers
+    counts = [args.samples // args.workers + (worker < args.samples % args.workers) for worker in range(args.workers)]
+
+    start = time.perf_counter()
+    # Spawn so every worker starts its own pybullet instead of sharing the parent's
+    with mp.get_context("spawn").Pool(args.workers) as pool:
+        written = sum(pool.starmap(generate_shards, [(worker, count, args) for worker, count in enumerate(counts) if count > 0]))
+    elapsed = time.perf_counter() - start
+
+    print(f"Wrote {written} images to {args.output} in {elapsed:.1f}s ({written / elapsed:.1f} images/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Learned dynamics model of the OT2 pipette for model-based rollouts.
+
+A small MLP learns to predict the next pipette position and velocity from the current ones and a 3-D action, from
+transitions collected with OT2_wrapper. ImaginedOT2VecEnv wraps the trained model as a batched stable baselines
+VecEnv that rolls out many goals at once on the model instead of pybullet, and evaluate_model_error /
+DynamicsErrorCallback keep track of how far the model drifts from real Simulation steps.
+
+    python dynamics_model.py --transitions 200000 --output models/dynamics.pt
+"""
+import argparse
+
+import numpy as np
+import torch as th
+from torch import nn
+from gymnasium import spaces
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnv
+
+from rewards import get_reward
+from sim_class import ENVELOPE_LOW, ENVELOPE_HIGH
+from ot2_gym_wrapper import OT2_wrapper
+
+
+def collect_transitions(env, num_steps, policy=None):
+    """Collects (state, action, next state) transitions from an OT2_wrapper.
+
+    The state is the pipette position followed by its velocity. Actions are sampled uniformly unless a policy
+    (anything with a stable baselines predict method) is given.
+
+    Returns:
+        states (T, 6), actions (T, 3), next_states (T, 6), start_states (E, 6): start_states holds the first state of every episode.
+    """
+    states, actions, next_states, start_states = [], [], [], []
+    observation, info = env.reset()
+    state = np.concatenate([observation[:3], np.zeros(3, dtype=np.float32)])
+    start_states.append(state)
+    for _ in range(num_steps):
+        if policy is None:
+            action = env.action_space.sample()
+        else:
+            action, _ = policy.predict(observation, deterministic=False)
+        observation, reward, terminated, truncated, info = env.step(action)
+        next_state = np.concatenate([info['Pipette coordinates'], info['Pipette velocity']])
+
+        states.append(state)
+        actions.append(np.clip(action, -1, 1))
+        next_states.append(next_state)
+
+        if terminated or truncated:
+            observation, info = env.reset()
+            next_state = np.concatenate([observation[:3], np.zeros(3, dtype=np.float32)])
+            start_states.append(next_state)
+        state = next_state
+
+    return (np.array(states, dtype=np.float32), np.array(actions, dtype=np.float32),
+            np.array(next_states, dtype=np.float32), np.array(start_states, dtype=np.float32))
+
+
+class DynamicsModel(nn.Module):
+    """MLP that predicts the change of the pipette state (position, velocity) caused by an action.
+
+    Inputs and outputs are normalized with statistics of the training data, which are stored as buffers so they
+    are saved and loaded with the state dict.
+    """
+    def __init__(self, hidden_size=128):
+        super(DynamicsModel, self).__init__()
+        self.net = nn.Sequential(
+            nn.Linear(9, hidden_size), nn.ReLU(),
+            nn.Linear(hidden_size, hidden_size), nn.ReLU(),
+            nn.Linear(hidden_size, 6),
+        )
+        self.register_buffer("input_mean", th.zeros(9))
+        self.register_buffer("input_std", th.ones(9))
+        self.register_buffer("delta_mean", th.zeros(6))
+        self.register_buffer("delta_std", th.ones(6))
+
+    def set_normalization(self, states, actions, next_states):
+        inputs = th.cat([states, actions], dim=1)
+        deltas = next_states - states
+        self.input_mean.copy_(inputs.mean(dim=0))
+        self.input_std.copy_(inputs.std(dim=0) + 1e-6)
+        self.delta_mean.copy_(deltas.mean(dim=0))
+        self.delta_std.copy_(deltas.std(dim=0) + 1e-6)
+
+    def normalized_delta(self, states, actions):
+        return self.net((th.cat([states, actions], dim=1) - self.input_mean) / self.input_std)
+
+    def forward(self, states, actions):
+        """Predicts the next states (N, 6) for a batch of states (N, 6) and actions (N, 3)."""
+        return states + self.normalized_delta(states, actions) * self.delta_std + self.delta_mean
+
+
+def train_dynamics(model, states, actions, next_states, epochs=20, batch_size=256, learning_rate=1e-3, verbose=0):
+    """Fits the model to the transitions on the normalized state change.
+
+    Returns:
+        List[float]: The mean training loss of every epoch.
+    """
+    states, actions, next_states = (th.as_tensor(x, dtype=th.float32) for x in (states, actions, next_states))
+    model.set_normalization(states, actions, next_states)
+    targets = ((next_states - states) - model.delta_mean) / model.delta_std
+    optimizer = th.optim.Adam(model.parameters(), lr=learning_rate)
+
+    losses = []
+    for epoch in range(epochs):
+        permutation = th.randperm(len(states))
+        epoch_loss = 0.0
+        for start in range(0, len(states), batch_size):
+            batch = permutation[start:start + batch_size]
+            loss = nn.functional.mse_loss(model.normalized_delta(states[batch], actions[batch]), targets[batch])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.item() * len(batch)
+        losses.append(epoch_loss / len(states))
+        if verbose > 0:
+            print(f"epoch {epoch + 1}/{epochs} loss {losses[-1]:.5f}")
+    return losses
+
+
+class ImaginedOT2VecEnv(VecEnv):
+    """Batched env that rolls out the OT2 goal reaching task on a learned dynamics model instead of pybullet.
+
+    Observations, actions, reward and termination match OT2_wrapper, so a policy trained on imagined data can be
+    used on the real env. Every step advances all num_envs goals with one forward pass of the model, and finished
+    envs are reset automatically like in any stable baselines VecEnv.
+
+    Args:
+        model (DynamicsModel): The trained dynamics model.
+        start_states (np.ndarray): (E, 6) states to start episodes from, e.g. the start_states of collect_transitions.
+        num_envs (int, optional): Number of goals rolled out at once. Defaults to 1024.
+    """
+    def __init__(self, model, start_states, num_envs=1024, max_steps=1000, reward="progress", distance_threshold=0.01, seed=None):
+        observation_space = spaces.Box(low=-1, high=1, shape=(6,), dtype=np.float32)
+        action_space = spaces.Box(low=-1, high=1, shape=(3,), dtype=np.float32)
+        super(ImaginedOT2VecEnv, self).__init__(num_envs, observation_space, action_space)
+        self.model = model.eval()
+        self.start_states = np.asarray(start_states, dtype=np.float32)
+        self.max_steps = max_steps
+        self.reward_fn = get_reward(reward)
+        self.distance_threshold = distance_threshold
+        self.min_threshold = 0.0001
+        self.max_threshold = 0.05
+        self.threshold_decay = 0.99
+        self.rng = np.random.default_rng(seed)
+
+        self.states = np.zeros((num_envs, 6), dtype=np.float32)
+        self.goals = np.zeros((num_envs, 3), dtype=np.float32)
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        self.episode_returns = np.zeros(num_envs, dtype=np.float64)
+        self.actions = None
+
+    def _reset_envs(self, mask):
+        n = int(mask.sum())
+        self.states[mask] = self.start_states[self.rng.integers(len(self.start_states), size=n)]
+        self.goals[mask] = self.rng.uniform(ENVELOPE_LOW, ENVELOPE_HIGH, size=(n, 3))
+        self.steps[mask] = 0
+        self.episode_returns[mask] = 0
+
+    def _observations(self):
+        return np.concatenate([self.states[:, :3], self.goals], axis=1)
+
+    def reset(self):
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+        return self._observations()
+
+    def step_async(self, actions):
+        self.actions = np.clip(actions, -1, 1).astype(np.float32)
+
+    def step_wait(self):
+        previous_observations = self._observations()
+        with th.no_grad():
+            self.states = self.model(th.as_tensor(self.states), th.as_tensor(self.actions)).numpy()
+        self.steps += 1
+        observations = self._observations()
+
+        # The model does not predict torques, so rewards that use them see zeros
+        joint_velocities = self.states[:, 3:] * np.array([-1, -1, 1], dtype=np.float32)
+        rewards, distances = self.reward_fn(observations, previous_observations, np.zeros_like(joint_velocities),
+                                            joint_velocities, self.distance_threshold)
+        terminated = distances < self.distance_threshold
+        rewards = rewards + terminated * 100
+        truncated = self.steps >= self.max_steps
+        dones = terminated | truncated
+        self.episode_returns += rewards
+
+        infos = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(dones):
+            # The same episode statistics a Monitor adds, the curriculum callbacks and ep_info_buffer read them
+            infos[i]["episode"] = {"r": float(self.episode_returns[i]), "l": int(self.steps[i])}
+            infos[i]["terminal_observation"] = observations[i]
+            infos[i]["TimeLimit.truncated"] = bool(truncated[i] and not terminated[i])
+            infos[i]["Terminated"] = "goal_reached" if terminated[i] else None
+        if dones.any():
+            self._reset_envs(dones)
+            observations = self._observations()
+        return observations, rewards.astype(np.float32), dones, infos
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        # All envs share one set of attributes, so the value is set for every env whatever the indices
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # All envs share one model and threshold, so the method is called once and changes every env whatever the indices
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        return [result for _ in self._get_indices(indices)]
+
+    # The curriculum methods of OT2_wrapper only use the threshold attributes, so the callbacks in ot2_gym_wrapper.py
+    # drive this env through env_method the same way they drive the real one
+    update_distance_threshold = OT2_wrapper.update_distance_threshold
+    scale_distance_threshold = OT2_wrapper.scale_distance_threshold
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        return [seed for _ in range(self.num_envs)]
+
+
+def evaluate_model_error(model, env, num_steps=1000, horizon=10, policy=None):
+    """Compares the model with real Simulation steps of an OT2_wrapper.
+
+    Returns:
+        dict: Mean and max error of the predicted pipette position after one step and after an open-loop rollout of
+        horizon steps, in metres.
+    """
+    states, actions, next_states, _ = collect_transitions(env, num_steps, policy)
+    with th.no_grad():
+        predicted = model(th.as_tensor(states), th.as_tensor(actions)).numpy()
+        one_step = np.linalg.norm(predicted[:, :3] - next_states[:, :3], axis=1)
+
+        # Open-loop rollouts from every horizon-th state, skipping windows that cross an episode boundary
+        horizon_errors = []
+        for start in range(0, len(states) - horizon, horizon):
+            window = slice(start, start + horizon)
+            if not np.allclose(next_states[window][:-1], states[window][1:]):
+                continue
+            state = th.as_tensor(states[start:start + 1])
+            for action in actions[window]:
+                state = model(state, th.as_tensor(action[None]))
+            horizon_errors.append(np.linalg.norm(state[0, :3].numpy() - next_states[start + horizon - 1, :3]))
+
+    return {
+        "one_step_mean": float(one_step.mean()),
+        "one_step_max": float(one_step.max()),
+        f"{horizon}_step_mean": float(np.mean(horizon_errors)) if horizon_errors else np.nan,
+        f"{horizon}_step_max": float(np.max(horizon_errors)) if horizon_errors else np.nan,
+    }
+
+
+class DynamicsErrorCallback(BaseCallback):
+    """Logs the error of the dynamics model against a real OT2_wrapper every eval_freq steps of training on imagined data."""
+    def __init__(self, dynamics_model, real_env, eval_freq=50000, num_steps=500, horizon=10, verbose=0):
+        super(DynamicsErrorCallback, self).__init__(verbose)
+        self.dynamics_model = dynamics_model
+        self.real_env = real_env
+        self.eval_freq = eval_freq
+        self.num_steps = num_steps
+        self.horizon = horizon
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.eval_freq == 0:
+            errors = evaluate_model_error(self.dynamics_model, self.real_env, self.num_steps, self.horizon, policy=self.model)
+            for name, error in errors.items():
+                self.logger.record(f"dynamics/{name}", error)
+            if self.verbose > 0:
+                print(f"Dynamics model error: {errors}")
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transitions", type=int, default=200000)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--output", type=str, default="models/dynamics.pt")
+    args = parser.parse_args()
+
+    env = OT2_wrapper(max_steps=1000)
+    states, actions, next_states, start_states = collect_transitions(env, args.transitions)
+    model = DynamicsModel()
+    train_dynamics(model, states, actions, next_states, epochs=args.epochs, verbose=1)
+    th.save({"model": model.state_dict(), "start_states": start_states}, args.output)
+    print(f"Saved {args.output}, error against the simulation: {evaluate_model_error(model, env)}")
+    env.close()
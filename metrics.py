@@ -0,0 +1,173 @@
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.logger import KVWriter
+
+
+class MetricsSink:
+    """Buffers metrics in memory and appends them to a local file from a background thread.
+
+    Logging only appends a record to a list, so it costs the training thread next to nothing and never waits on
+    disk or network. Every flush_interval seconds, or as soon as max_buffer records are waiting, the writer thread
+    swaps the buffer out and appends the records as JSON lines to <log_dir>/metrics.jsonl. The file is append-only,
+    so a crash loses at most the records of the last interval. Use export_csv or export_tensorboard (or
+    `python metrics.py export`) to convert it afterwards.
+    """
+    def __init__(self, log_dir, flush_interval=5.0, max_buffer=10000):
+        self.log_dir = log_dir
+        self.path = os.path.join(log_dir, "metrics.jsonl")
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        os.makedirs(log_dir, exist_ok=True)
+
+        self.buffer = []
+        self.lock = threading.Lock()
+        # Held across swapping the buffer and writing it, so flushes from the training thread and the writer thread
+        # never write to the file at the same time and the records stay in order
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = False
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def log(self, kind, name, value, step):
+        """Adds a record. kind groups the records, e.g. "scalar", "episode" or "curriculum"."""
+        with self.lock:
+            self.buffer.append((kind, name, value, step, time.time()))
+            full = len(self.buffer) >= self.max_buffer
+        if full:
+            self.wake.set()
+
+    def log_scalar(self, name, value, step):
+        self.log("scalar", name, value, step)
+
+    def log_dict(self, values, step, kind="scalar"):
+        for name, value in values.items():
+            self.log(kind, name, value, step)
+
+    def flush(self):
+        """Writes the buffered records to disk, on the calling thread."""
+        with self.write_lock:
+            with self.lock:
+                records, self.buffer = self.buffer, []
+            if not records:
+                return
+            with open(self.path, "a") as f:
+                for kind, name, value, step, wall_time in records:
+                    f.write(json.dumps({"kind": kind, "name": name, "value": float(value), "step": int(step), "time": wall_time}) + "\n")
+
+    def close(self):
+        # Stop the writer and write whatever is left in the buffer
+        self.closed = True
+        self.wake.set()
+        self.writer.join()
+        self.flush()
+
+    def _write_loop(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+
+class SinkOutputFormat(KVWriter):
+    """Stable baselines logger output that forwards the logged values (rollout/, train/, time/ ...) to a MetricsSink.
+
+    Example:
+        model.set_logger(Logger(None, [HumanOutputFormat(sys.stdout), SinkOutputFormat(sink)]))
+    """
+    def __init__(self, sink):
+        self.sink = sink
+
+    def write(self, key_values, key_excluded, step=0):
+        for key, value in key_values.items():
+            # Only numbers can be stored, strings and videos are skipped
+            if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+                self.sink.log_scalar(key, value, step)
+
+    def close(self):
+        self.sink.flush()
+
+
+class MetricsCallback(BaseCallback):
+    """Logs the statistics of every finished episode and the curriculum state of the envs to a MetricsSink."""
+    def __init__(self, sink, curriculum_freq=1000, verbose=0):
+        super(MetricsCallback, self).__init__(verbose)
+        self.sink = sink
+        self.curriculum_freq = curriculum_freq
+
+    def _on_step(self) -> bool:
+        # The Monitor wrapper adds an "episode" entry to the info of the last step of every episode
+        for info in self.locals["infos"]:
+            episode = info.get("episode")
+            if episode is not None:
+                self.sink.log("episode", "reward", episode["r"], self.num_timesteps)
+                self.sink.log("episode", "length", episode["l"], self.num_timesteps)
+                self.sink.log("episode", "goal_reached", info.get("Terminated") == "goal_reached", self.num_timesteps)
+
+        if self.n_calls % self.curriculum_freq == 0:
+            thresholds = self.training_env.get_attr("distance_threshold")
+            self.sink.log("curriculum", "distance_threshold", np.mean(thresholds), self.num_timesteps)
+        return True
+
+    def _on_training_end(self) -> None:
+        self.sink.flush()
+
+
+def read_metrics(log_dir):
+    """Reads the records of a metrics.jsonl file, skipping a last line that was cut off by a crash."""
+    path = os.path.join(log_dir, "metrics.jsonl")
+    with open(path) as f:
+        lines = f.readlines()
+    records = []
+    for number, line in enumerate(lines, start=1):
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            if number < len(lines):
+                raise ValueError(f"{path} is corrupted at line {number}")
+    return records
+
+
+def export_csv(log_dir, output):
+    records = read_metrics(log_dir)
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["kind", "name", "step", "value", "time"])
+        writer.writeheader()
+        writer.writerows(records)
+    print(f"Wrote {len(records)} records to {output}")
+
+
+def export_tensorboard(log_dir, output):
+    from torch.utils.tensorboard import SummaryWriter
+
+    records = read_metrics(log_dir)
+    writer = SummaryWriter(log_dir=output)
+    for record in records:
+        # Scalars from the stable baselines logger already carry their group (rollout/, train/) in the name
+        tag = record["name"] if record["kind"] == "scalar" else f"{record['kind']}/{record['name']}"
+        writer.add_scalar(tag, record["value"], global_step=record["step"], walltime=record["time"])
+    writer.close()
+    print(f"Wrote {len(records)} records to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a local metrics log to CSV or TensorBoard")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export")
+    export.add_argument("log_dir", type=str)
+    export.add_argument("--format", choices=["csv", "tensorboard"], default="csv")
+    export.add_argument("--output", type=str, default=None,
+                        help="defaults to <log_dir>/metrics.csv or <log_dir>/tensorboard")
+    args = parser.parse_args()
+
+    if args.format == "csv":
+        export_csv(args.log_dir, args.output or os.path.join(args.log_dir, "metrics.csv"))
+    else:
+        export_tensorboard(args.log_dir, args.output or os.path.join(args.log_dir, "tensorboard"))
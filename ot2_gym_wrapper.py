@@ -2,25 +2,36 @@ from grpc import Status
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
-from sim_class import Simulation
+from sim_class import Simulation, ENVELOPE_LOW, ENVELOPE_HIGH
+from rewards import get_reward, status_to_arrays
 import pybullet as p
 from stable_baselines3.common.callbacks import BaseCallback
 
 class OT2_wrapper(gym.Env):
-    def __init__(self, render=False, max_steps=1000):
+    def __init__(self, render=False, max_steps=1000, reward="progress", sim=None):
         # Calls the constructor off the parent class while being bound to the instance of this wrapper
         super(OT2_wrapper, self).__init__()
 
         # Overwrites render method but I do not know why, The mentors provided this
         self.render = render 
         self.distance_threshold = 0.01
+        # Bounds used by update_distance_threshold when the curriculum tightens or loosens the threshold
+        # The upper bound keeps a struggling curriculum from loosening the task until every episode ends on its first step
+        self.min_threshold = 0.0001
+        self.max_threshold = 0.05
+        self.threshold_decay = 0.99
+
+        # The reward function is looked up in the registry in rewards.py so experiments do not need to edit the env
+        self.reward_fn = get_reward(reward)
+        self.previous_observation = None
 
         # Sets some properties that are used during the training of a model
         self.max_steps = max_steps
         self.goal_position = None
 
         # Sets a pybullet simulation instance with only 1 agent as multiple are not reported
-        self.sim = Simulation(render=render, num_agents=1)
+        # An already built simulation can be passed in, the pre-forked worker pool in worker_pool.py uses this
+        self.sim = sim if sim is not None else Simulation(render=render, num_agents=1)
 
         # Define action and observation space
         # They must be gym.spaces objects
@@ -48,13 +59,8 @@ class OT2_wrapper(gym.Env):
         if seed is not None:
             np.random.seed(seed)
 
-        # Minimum and maximum gotten from task 9
-        # These make sure that the goal generated are within the working envelope of the OT2
-        low_bound = [-0.17, -0.16, 0.16]
-        high_bound = [0.24, 0.21, 0.28]
-
-        # Generates a 3 random numbers according to the observation space definition
-        self.goal_position = np.random.uniform(low=low_bound, high=high_bound, size=(3,)).astype(np.float32)
+        # Generates a 3 random numbers within the working envelope of the OT2
+        self.goal_position = np.random.uniform(low=ENVELOPE_LOW, high=ENVELOPE_HIGH, size=(3,)).astype(np.float32)
 
         # This resets the simulation so it always has a fresh start
         status = self.sim.reset(num_agents=1)
@@ -70,6 +76,8 @@ class OT2_wrapper(gym.Env):
 
         # Everytime the simulation is reset for whatever reason the current amount of used steps need to be reset
         self.steps = 0
+        # Rewards that compare against the previous step start from the reset position
+        self.previous_observation = observation
 
         # The Gymnasium expects the observations to be returned and a dictionary with info, We do not provide any info in this fuction so a empty dictionary is returned to avoid errors
         return observation, {}
@@ -81,8 +89,15 @@ class OT2_wrapper(gym.Env):
                 self.min_threshold, self.distance_threshold * self.threshold_decay
             )
         elif success_rate < 0.2:  # Increase threshold if success rate is low
-            self.distance_threshold *= 1.01  # Make the task easier
+            self.distance_threshold = min(self.max_threshold, self.distance_threshold * 1.01)  # Make the task easier
 
+    def scale_distance_threshold(self, factor, minimum=0.0, maximum=None):
+        """Multiply the distance threshold by factor and keep it between minimum and maximum (max_threshold by default).
+
+        Callbacks call this through VecEnv.env_method so it also reaches envs living in subprocesses.
+        """
+        maximum = self.max_threshold if maximum is None else maximum
+        self.distance_threshold = min(maximum, max(minimum, self.distance_threshold * factor))
 
     def step(self, action: np.ndarray):
         action = np.clip(action, self.action_space.low, self.action_space.high)  # Validate action
@@ -93,12 +108,10 @@ class OT2_wrapper(gym.Env):
         except Exception as e:
             raise RuntimeError(f"Simulation failed: {e}")
 
-        robot_id = list(observation_data.keys())[0]
-        observation = []
-        position = np.array(observation_data[robot_id]['pipette_position'], dtype=np.float32)
-        observation = np.concatenate([position, self.goal_position])
+        positions, joint_torques, joint_velocities = status_to_arrays(observation_data)
+        observation = np.concatenate([positions[0], self.goal_position])
 
-        reward, distance = self.compute(observation)
+        reward, distance = self.compute(observation, joint_torques[0], joint_velocities[0])
         terminated, termination_reason, bonus = self.check_termination(distance)
         reward += bonus
 
@@ -107,6 +120,8 @@ class OT2_wrapper(gym.Env):
             'Truncated': 'Max steps reached' if truncated else None,
             'Terminated': termination_reason if terminated else None,
             'Pipette coordinates': observation[:3],
+            # The x and y joints move the pipette in the negative direction
+            'Pipette velocity': joint_velocities[0] * np.array([-1, -1, 1], dtype=np.float32),
             'Distance from goal': distance,
             'Reward': reward
         }
@@ -118,23 +133,30 @@ class OT2_wrapper(gym.Env):
     def render(self, mode='human'):
         pass
 
-    def compute(self, observation):
-        """Computes the reward for the Reinforcement learning model
+    def compute(self, observation, joint_torques=None, joint_velocities=None):
+        """Computes the reward for the Reinforcement learning model with the reward function picked in the constructor
 
         Args:
             observation (List): Contains the x, y, z of the pipette and goal location
+            joint_torques (np.ndarray, optional): Motor torques of the x, y, z joints. Defaults to zeros.
+            joint_velocities (np.ndarray, optional): Velocities of the x, y, z joints. Defaults to zeros.
 
         Returns:
             reward, np.float32: The reward for the model
+            distance, np.float32: The distance between the pipette and the goal
         """
-        # Eucludian distance, hell yeah https://www.tiktok.com/@sivartstock/video/7264039747142618373
-        distance = np.linalg.norm(observation[:3] - observation[3:6])
-        previous_distance = getattr(self, 'previous_distance', distance)
-        reward = previous_distance - distance  # Reward improvement
-        self.previous_distance = distance  # Update for next step
-        return reward, distance
-
-
+        if joint_torques is None:
+            joint_torques = np.zeros(3, dtype=np.float32)
+        if joint_velocities is None:
+            joint_velocities = np.zeros(3, dtype=np.float32)
+        if self.previous_observation is None:
+            self.previous_observation = observation
+
+        # The reward functions work on batches, the single agent is a batch of one
+        rewards, distances = self.reward_fn(observation[None], self.previous_observation[None],
+                                            joint_torques[None], joint_velocities[None], self.distance_threshold)
+        self.previous_observation = observation  # Update for next step
+        return rewards[0], distances[0]
 
     def check_termination(self, distance):
         """Checks if the distance is within the distance_threshold
@@ -156,67 +178,118 @@ class OT2_wrapper(gym.Env):
         """
         self.sim.close()
 
+class OT2GoalEnv(OT2_wrapper):
+    """Goal-conditioned version of OT2_wrapper for hindsight experience replay.
+
+    The observation is split into a dictionary with the pipette position as observation and achieved_goal and the
+    goal position as desired_goal. compute_reward can recompute the reward of any transition for any goal, so a
+    HerReplayBuffer can relabel failed trajectories with the positions the pipette actually reached.
+    """
+    def __init__(self, render=False, max_steps=1000, reward="sparse", sim=None):
+        super(OT2GoalEnv, self).__init__(render=render, max_steps=max_steps, reward=reward, sim=sim)
+        self.observation_space = spaces.Dict({
+            'observation': spaces.Box(low=-1, high=1, shape=(3,), dtype=np.float32),
+            'achieved_goal': spaces.Box(low=-1, high=1, shape=(3,), dtype=np.float32),
+            'desired_goal': spaces.Box(low=-1, high=1, shape=(3,), dtype=np.float32),
+        })
+
+    def goal_observation(self, observation):
+        return {
+            'observation': observation[:3].astype(np.float32),
+            'achieved_goal': observation[:3].astype(np.float32),
+            'desired_goal': observation[3:6].astype(np.float32),
+        }
+
+    def reset(self, seed=None):
+        observation, info = super(OT2GoalEnv, self).reset(seed=seed)
+        return self.goal_observation(observation), info
+
+    def step(self, action: np.ndarray):
+        observation, reward, terminated, truncated, info = super(OT2GoalEnv, self).step(action)
+        # The reward has to be the one compute_reward gives, otherwise relabeled transitions would be rewarded differently
+        reward = float(self.compute_reward(observation[:3], observation[3:6], info))
+        info['Reward'] = reward
+        return self.goal_observation(observation), reward, terminated, truncated, info
+
+    def compute_reward(self, achieved_goal, desired_goal, info):
+        """Computes the reward for one or a batch of achieved and desired goals with the reward function of the env.
+
+        Rewards that compare against the previous step (like progress) can not be recomputed for another goal, use a
+        reward that only depends on the goal distance such as sparse or negative_distance.
+        """
+        batched = np.ndim(achieved_goal) == 2
+        achieved_goal = np.atleast_2d(achieved_goal)
+        desired_goal = np.atleast_2d(desired_goal)
+        observations = np.concatenate([achieved_goal, desired_goal], axis=1)
+        zeros = np.zeros_like(achieved_goal)
+        rewards, _ = self.reward_fn(observations, observations, zeros, zeros, self.distance_threshold)
+        rewards = rewards.astype(np.float32)
+        return rewards if batched else rewards[0]
+
+
 class RewardShapingCallback(BaseCallback):
-    def __init__(self, verbose=0):
+    """Tightens the distance threshold by 0.1% per step, applied in one go every update_freq steps."""
+    def __init__(self, update_freq=1000, verbose=0):
         super(RewardShapingCallback, self).__init__(verbose)
+        self.update_freq = update_freq
 
     def _on_step(self) -> bool:
-        env = self.training_env.envs[0]
-        if isinstance(env, OT2_wrapper):
-            env.distance_threshold = max(0.0001, env.distance_threshold * 0.999)
-            # Adjust reward multiplier
-            env.reward_scale = getattr(env, 'reward_scale', 1.0) * 1.01
-
+        # env_method reaches every env, also when they are wrapped in a Monitor or live in a SubprocVecEnv
+        # It is a round trip to every worker under a SubprocVecEnv, so the per step decay is batched
+        if self.n_calls % self.update_freq == 0:
+            self.training_env.env_method("scale_distance_threshold", 0.999 ** self.update_freq, 0.0001)
 
         return True
-    
+
+
+def episode_successes(infos):
+    """Whether each episode that finished this step reached its goal, read from the infos of a VecEnv step."""
+    # The Monitor wrapper adds an "episode" entry to the info of the last step of every episode
+    return [info.get("Terminated") == "goal_reached" for info in infos if "episode" in info]
+
+
 class CurriculumCallback(BaseCallback):
-    def __init__(self, verbose=0):
+    def __init__(self, update_freq=1000, verbose=0):
         super(CurriculumCallback, self).__init__(verbose)
         self.success_buffer = []
         self.target_success_rate = 0.8  # Aim for 80% success rate
-        self.buffer_size = 100  # Sliding window size for calculating success rate
+        self.buffer_size = 100  # Sliding window of finished episodes for calculating success rate
+        self.update_freq = update_freq  # Steps between threshold updates
 
     def _on_step(self) -> bool:
-        # Access the environment
-        env = self.training_env.envs[0]  # Assuming a single environment
-        if isinstance(env, OT2_wrapper):
-            # Check if the current episode ended with success
-            success = any(info.get("Terminated") == "goal_reached" for info in self.locals["infos"])
-            self.success_buffer.append(success)
-
-            # Keep the buffer size fixed
-            if len(self.success_buffer) > self.buffer_size:
-                self.success_buffer.pop(0)
-
-            # Calculate success rate and update the distance threshold
-            if len(self.success_buffer) == self.buffer_size:
-                success_rate = sum(self.success_buffer) / self.buffer_size
-                env.update_distance_threshold(success_rate)
+        # Record whether each episode that ended this step reached its goal
+        self.success_buffer.extend(episode_successes(self.locals["infos"]))
+
+        # Keep the buffer size fixed
+        del self.success_buffer[:-self.buffer_size]
+
+        # Calculate success rate and update the distance threshold
+        if self.n_calls % self.update_freq == 0 and len(self.success_buffer) == self.buffer_size:
+            success_rate = sum(self.success_buffer) / self.buffer_size
+            self.training_env.env_method("update_distance_threshold", success_rate)
 
         return True
 
 
 class AdaptiveThresholdCallback(BaseCallback):
-    def __init__(self, verbose=0):
+    def __init__(self, update_freq=1000, verbose=0):
         super(AdaptiveThresholdCallback, self).__init__(verbose)
         self.target_success_rate = 0.8  # Aim for 80% success rate
         self.success_buffer = []
+        self.buffer_size = 100  # Sliding window of finished episodes
+        self.update_freq = update_freq  # Steps between threshold updates
 
     def _on_step(self) -> bool:
-        env = self.training_env.envs[0]
-        if isinstance(env, OT2_wrapper):
-            success = any(info.get("Terminated") == "goal_reached" for info in self.locals["infos"])
-            self.success_buffer.append(success)
-
-            # Adjust distance threshold based on recent success rate
-            if len(self.success_buffer) > 100:  # Buffer size
-                success_rate = sum(self.success_buffer) / len(self.success_buffer)
-                if success_rate > self.target_success_rate:
-                    env.distance_threshold *= 0.99  # Make task harder
-                else:
-                    env.distance_threshold *= 1.01  # Make task easier
-                self.success_buffer.pop(0)
+        self.success_buffer.extend(episode_successes(self.locals["infos"]))
+        del self.success_buffer[:-self.buffer_size]
+
+        # Adjust distance threshold based on recent success rate, within the bounds of the env
+        if self.n_calls % self.update_freq == 0 and len(self.success_buffer) == self.buffer_size:
+            success_rate = sum(self.success_buffer) / len(self.success_buffer)
+            if success_rate > self.target_success_rate:
+                self.training_env.env_method("scale_distance_threshold", 0.99, 0.0001)  # Make task harder
+            else:
+                self.training_env.env_method("scale_distance_threshold", 1.01, 0.0001)  # Make task easier
         return True
 
 
@@ -0,0 +1,177 @@
+"""Physics-equivalence regression harness for the OT2 Simulation.
+
+Replays a fixed library of seeded action sequences through Simulation.run and compares the recorded pipette
+trajectories, joint torques and velocities and droplet landing positions with golden recordings, together with the
+difference in wall-clock time. Record the golden files on the commit before a performance change, then compare
+with the change applied:
+
+    python physics_regression.py record
+    python physics_regression.py compare
+    python physics_regression.py compare --sim_kwargs '{"num_agents": 4}'
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pybullet as p
+
+from sim_class import Simulation
+from rewards import status_to_arrays
+
+GOLDEN_DIR = "golden"
+
+# Largest allowed absolute difference per signal
+TOLERANCES = {
+    "pipette": 1e-4,        # m
+    "joint_velocities": 1e-3,  # m/s
+    "joint_torques": 1.0,   # N, the motors run at 500-800
+    "droplets": 5e-4,       # m
+}
+
+
+def random_walk(rng, num_agents, steps):
+    # Velocities that change every 50 steps, no droplets
+    velocities = rng.uniform(-1, 1, size=(steps // 50 + 1, num_agents, 3)).repeat(50, axis=0)[:steps]
+    return np.concatenate([velocities, np.zeros((steps, num_agents, 1))], axis=2)
+
+
+def corners(rng, num_agents, steps):
+    # Drive into the corners of the working envelope so the joint limits and motor torques are exercised
+    directions = np.array([[1, 1, 1], [-1, 1, 1], [-1, -1, 1], [1, -1, 1], [1, -1, -1], [1, 1, -1], [-1, 1, -1], [-1, -1, -1]])
+    order = rng.permutation(len(directions))
+    velocities = directions[order].repeat(steps // len(directions) + 1, axis=0)[:steps]
+    velocities = np.broadcast_to(velocities[:, None], (steps, num_agents, 3))
+    return np.concatenate([velocities, np.zeros((steps, num_agents, 1))], axis=2)
+
+
+def dispense(rng, num_agents, steps):
+    # Slow moves over the plate while dropping a droplet every 20 steps. Every 50 step move is followed by the opposite
+    # move, so the pipette stays within a few cm of the middle of the specimen it starts over
+    velocities = rng.uniform(-0.1, 0.1, size=(steps // 100 + 1, num_agents, 3))
+    velocities = np.stack([velocities, -velocities], axis=1).reshape(-1, num_agents, 3).repeat(50, axis=0)[:steps]
+    actions = np.concatenate([velocities, np.zeros((steps, num_agents, 1))], axis=2)
+    actions[::20, :, 3] = 1
+    return actions
+
+
+# name -> (action generator, seed, steps, start with the pipette over the middle of the specimen)
+SEQUENCES = {
+    "random_walk": (random_walk, 0, 1000, False),
+    "corners": (corners, 1, 1600, False),
+    "dispense": (dispense, 2, 1000, True),
+}
+
+
+def record(sequence, sim_kwargs=None):
+    """Runs one sequence of the library through a fresh Simulation and records its signals.
+
+    Returns:
+        dict: pipette, joint_torques and joint_velocities as (steps, agents, 3) arrays, droplets as (K, 4) rows of
+        [agent, x, y, z] in landing order and wall_time, the seconds spent in Simulation.run.
+    """
+    sim_kwargs = dict(sim_kwargs or {})
+    num_agents = sim_kwargs.pop("num_agents", 1)
+    generate, seed, steps, over_specimen = SEQUENCES[sequence]
+    actions = generate(np.random.default_rng(seed), num_agents, steps)
+
+    sim = Simulation(num_agents=num_agents, render=False, **sim_kwargs)
+    pipette, joint_torques, joint_velocities = [], [], []
+    wall_time = 0.0
+    try:
+        if over_specimen:
+            # Teleport every pipette over the middle of its own specimen at its current height, so the droplets land on it
+            for robotId, specimenId in zip(sim.robotIds, sim.specimenIds):
+                specimen_position = p.getBasePositionAndOrientation(specimenId)[0]
+                sim.set_pipette_position(robotId, specimen_position[0], specimen_position[1], sim.get_pipette_position(robotId)[2])
+
+        for step_actions in actions:
+            start = time.perf_counter()
+            status = sim.run(step_actions.tolist())
+            wall_time += time.perf_counter() - start
+            positions, torques, velocities = status_to_arrays(status)
+            pipette.append(positions)
+            joint_torques.append(torques)
+            joint_velocities.append(velocities)
+
+        droplets = []
+        for agent, specimenId in enumerate(sim.specimenIds):
+            for position in sim.droplet_positions.get(f'specimenId_{specimenId}', []):
+                droplets.append([agent, *position])
+    finally:
+        sim.close()
+
+    # Without landed droplets the landing positions would pass the comparison without being checked
+    if actions[:, :, 3].any() and not droplets:
+        raise RuntimeError(f"{sequence} dispensed droplets but none landed on a specimen")
+
+    return {
+        "pipette": np.array(pipette),
+        "joint_torques": np.array(joint_torques),
+        "joint_velocities": np.array(joint_velocities),
+        "droplets": np.array(droplets, dtype=np.float64).reshape(-1, 4),
+        "wall_time": np.array(wall_time),
+    }
+
+
+def golden_path(sequence, num_agents):
+    return os.path.join(GOLDEN_DIR, f"{sequence}_{num_agents}.npz")
+
+
+def compare(golden, candidate, tolerances=TOLERANCES):
+    """Compares a candidate recording with a golden one.
+
+    Returns:
+        List[dict]: Per signal the largest difference, its tolerance and whether it passed.
+    """
+    results = []
+    for signal in ["pipette", "joint_torques", "joint_velocities"]:
+        error = float(np.max(np.abs(golden[signal] - candidate[signal])))
+        results.append({"signal": signal, "error": error, "tolerance": tolerances[signal], "passed": error <= tolerances[signal]})
+
+    # Droplets are matched in landing order per agent, a different number of landed droplets is a failure
+    golden_droplets, candidate_droplets = golden["droplets"], candidate["droplets"]
+    if len(golden_droplets) != len(candidate_droplets) or np.any(golden_droplets[:, 0] != candidate_droplets[:, 0]):
+        results.append({"signal": "droplets", "error": np.inf, "tolerance": tolerances["droplets"], "passed": False,
+                        "note": f"{len(candidate_droplets)} landed, golden has {len(golden_droplets)}"})
+    else:
+        error = float(np.max(np.linalg.norm(golden_droplets[:, 1:] - candidate_droplets[:, 1:], axis=1), initial=0.0))
+        results.append({"signal": "droplets", "error": error, "tolerance": tolerances["droplets"], "passed": error <= tolerances["droplets"]})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["record", "compare"])
+    parser.add_argument("--sequences", type=str, nargs="+", default=list(SEQUENCES))
+    parser.add_argument("--sim_kwargs", type=json.loads, default={},
+                        help="JSON arguments for Simulation, e.g. the fidelity settings of the change under test")
+    args = parser.parse_args()
+
+    num_agents = args.sim_kwargs.get("num_agents", 1)
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    failed = False
+    for sequence in args.sequences:
+        recording = record(sequence, args.sim_kwargs)
+        path = golden_path(sequence, num_agents)
+
+        if args.command == "record":
+            np.savez_compressed(path, **recording)
+            print(f"{sequence}: recorded {path} in {float(recording['wall_time']):.2f}s")
+            continue
+
+        golden = np.load(path)
+        golden_time, candidate_time = float(golden["wall_time"]), float(recording["wall_time"])
+        print(f"{sequence}: {candidate_time:.2f}s against {golden_time:.2f}s golden ({golden_time / candidate_time:.2f}x speedup)")
+        for result in compare(golden, recording):
+            status = "ok" if result["passed"] else "FAIL"
+            print(f"    {result['signal']:<17} error {result['error']:.3g} (tolerance {result['tolerance']:g}) {status} {result.get('note', '')}")
+            failed |= not result["passed"]
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import math
+import os
+import queue
+import threading
+
+import gymnasium as gym
+import imageio
+import numpy as np
+import pybullet as p
+
+
+class FrameWriter:
+    """Encodes frames to a video file on a background thread.
+
+    Frames go through a bounded queue, so memory stays constant however long the recording is: when the encoder
+    falls behind, write blocks until there is room again. Everything encoded so far is on disk, also when the run
+    crashes before close is called.
+    """
+    def __init__(self, path, fps=30, max_pending=32):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.frames = queue.Queue(maxsize=max_pending)
+        self.writer = imageio.get_writer(path, fps=fps)
+        self.error = None
+        self.thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        if self.error is not None:
+            raise RuntimeError(f"Encoding {self.path} failed: {self.error}")
+        self.frames.put(frame)
+
+    def close(self):
+        # Encode the frames that are still queued and finish the file
+        self.frames.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise RuntimeError(f"Encoding {self.path} failed: {self.error}")
+
+    def _encode_loop(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                return
+            # After a failed frame the loop keeps draining the queue, so a blocked write or close never hangs;
+            # the error is raised there instead
+            if self.error is not None:
+                continue
+            try:
+                self.writer.append_data(frame)
+            except Exception as e:
+                self.error = e
+
+
+def render_frame(width=320, height=240):
+    """Renders the whole scene with the same camera Simulation.run uses for current_frame."""
+    view_matrix = p.computeViewMatrix([1, 0, 1], [-0.3, 0, 0], [0, 0, 1])
+    projection_matrix = p.computeProjectionMatrixFOV(50, width / height, 0.1, 100.0)
+    _, _, rgba, _, _ = p.getCameraImage(width=width, height=height, viewMatrix=view_matrix, projectionMatrix=projection_matrix)
+    return np.reshape(rgba, (height, width, 4))[:, :, :3].astype(np.uint8)
+
+
+def render_tiled_frame(robotIds, width=320, height=240):
+    """Renders a camera per robot and tiles the images in a grid, the same grid the robots are placed in."""
+    grid_size = math.ceil(len(robotIds) ** 0.5)
+    tiles = np.zeros((grid_size * height, grid_size * width, 3), dtype=np.uint8)
+    projection_matrix = p.computeProjectionMatrixFOV(50, width / height, 0.1, 100.0)
+    for n, robotId in enumerate(robotIds):
+        # Look at the working envelope of this robot
+        target = np.array(p.getBasePositionAndOrientation(robotId)[0]) + [0.05, 0.05, 0.15]
+        view_matrix = p.computeViewMatrix((target + [0.6, 0, 0.35]).tolist(), target.tolist(), [0, 0, 1])
+        _, _, rgba, _, _ = p.getCameraImage(width=width, height=height, viewMatrix=view_matrix, projectionMatrix=projection_matrix)
+        row, column = divmod(n, grid_size)
+        tiles[row * height:(row + 1) * height, column * width:(column + 1) * width] = np.reshape(rgba, (height, width, 4))[:, :, :3]
+    return tiles
+
+
+class SimulationRecorder:
+    """Wraps a Simulation and streams a video of it to disk while it runs.
+
+    Use it in place of the simulation, every other attribute is passed through:
+
+        sim = SimulationRecorder(Simulation(num_agents=4, render=False), "videos/run.mp4", every=4, tile_agents=True)
+        status = sim.run(actions)
+        sim.close()
+
+    Args:
+        sim (Simulation): The simulation to record.
+        path (str): Video file to write, the format follows from the extension (.mp4 needs imageio-ffmpeg, .gif works without).
+        every (int, optional): Only every n-th step is recorded. Defaults to 1.
+        tile_agents (bool, optional): Render a camera per agent and tile them instead of one overview. Defaults to False.
+        fps (int, optional): Frame rate of the video. Defaults to 30.
+    """
+    def __init__(self, sim, path, every=1, tile_agents=False, fps=30, width=320, height=240):
+        self.sim = sim
+        self.every = every
+        self.tile_agents = tile_agents
+        self.width = width
+        self.height = height
+        self.steps = 0
+        self.frame_writer = FrameWriter(path, fps=fps)
+
+    def __getattr__(self, name):
+        return getattr(self.sim, name)
+
+    def capture(self):
+        if self.tile_agents:
+            frame = render_tiled_frame(self.sim.robotIds, self.width, self.height)
+        else:
+            frame = render_frame(self.width, self.height)
+        self.frame_writer.write(frame)
+
+    def run(self, actions, num_steps=1):
+        if num_steps == 0:
+            return self.sim.get_states()
+        # Step one at a time so the decimation also applies within num_steps
+        for _ in range(num_steps):
+            status = self.sim.run(actions)
+            if self.steps % self.every == 0:
+                self.capture()
+            self.steps += 1
+        return status
+
+    def close(self):
+        try:
+            self.frame_writer.close()
+        finally:
+            self.sim.close()
+
+
+class RecordEpisodeVideo(gym.Wrapper):
+    """Gymnasium wrapper for OT2_wrapper that streams a video of every episode to <video_dir>/episode_<n>.<video_format>.
+
+    Args:
+        env (OT2_wrapper): The env to record.
+        video_dir (str): Directory the videos are written to.
+        every (int, optional): Only every n-th step is recorded. Defaults to 1.
+        episode_trigger (callable, optional): Gets the episode number and returns whether to record it. Defaults to every episode.
+        video_format (str, optional): Extension of the videos. Defaults to "mp4", which is encoded with imageio-ffmpeg.
+    """
+    def __init__(self, env, video_dir, every=1, episode_trigger=None, video_format="mp4", fps=30, width=320, height=240):
+        super(RecordEpisodeVideo, self).__init__(env)
+        self.video_dir = video_dir
+        self.video_format = video_format
+        self.every = every
+        self.episode_trigger = episode_trigger or (lambda episode: True)
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.episode = -1
+        self.steps = 0
+        self.frame_writer = None
+
+    def reset(self, **kwargs):
+        self._close_video()
+        observation, info = self.env.reset(**kwargs)
+        self.episode += 1
+        self.steps = 0
+        if self.episode_trigger(self.episode):
+            self.frame_writer = FrameWriter(os.path.join(self.video_dir, f"episode_{self.episode}.{self.video_format}"), fps=self.fps)
+            self.frame_writer.write(render_frame(self.width, self.height))
+        return observation, info
+
+    def step(self, action):
+        observation, reward, terminated, truncated, info = self.env.step(action)
+        self.steps += 1
+        if self.frame_writer is not None and self.steps % self.every == 0:
+            self.frame_writer.write(render_frame(self.width, self.height))
+        return observation, reward, terminated, truncated, info
+
+    def _close_video(self):
+        # Forget the writer before closing it, so a failed video is only reported once
+        frame_writer, self.frame_writer = self.frame_writer, None
+        if frame_writer is not None:
+            frame_writer.close()
+
+    def close(self):
+        try:
+            self._close_video()
+        finally:
+            super(RecordEpisodeVideo, self).close()
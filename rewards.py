@@ -0,0 +1,83 @@
+"""Reward functions for the OT2 environments.
+
+Every reward is evaluated over a batch of agents at once so the same function serves the single agent OT2_wrapper
+(a batch of one) and environments with many agents without a Python loop per agent. A reward takes
+
+    observations (N, 6):          pipette xyz followed by goal xyz, after the step
+    previous_observations (N, 6): the observations before the step
+    joint_torques (N, 3):         motor torques of the x, y and z joints
+    joint_velocities (N, 3):      velocities of the x, y and z joints
+    distance_threshold (float):   distance at which the goal counts as reached
+
+and returns the rewards (N,) and the distances to the goal (N,). New rewards are added with the register_reward
+decorator and picked by name, e.g. OT2_wrapper(reward="shaped_distance"). The iterations in reward_iterations.md
+are registered here under their own names.
+"""
+import numpy as np
+
+REWARDS = {}
+
+
+def register_reward(name):
+    """Decorator that adds a reward function to the registry under name."""
+    def decorator(reward_fn):
+        if name in REWARDS:
+            raise ValueError(f"Reward {name} is already registered")
+        REWARDS[name] = reward_fn
+        return reward_fn
+    return decorator
+
+
+def get_reward(name):
+    """Looks up a registered reward function by name."""
+    try:
+        return REWARDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown reward {name}, choose from {sorted(REWARDS)}") from None
+
+
+def goal_distance(observations):
+    """Euclidean distance between the pipette and the goal for every row of a (N, 6) observation batch."""
+    return np.linalg.norm(observations[:, :3] - observations[:, 3:6], axis=1)
+
+
+def status_to_arrays(status):
+    """Converts the status dictionary returned by Simulation.run into arrays for the reward functions.
+
+    Returns:
+        pipette_positions (N, 3), joint_torques (N, 3), joint_velocities (N, 3): In the order of the robots in status.
+    """
+    pipette_positions = np.array([robot['pipette_position'] for robot in status.values()], dtype=np.float32)
+    joint_torques = np.array([[joint['motor_torque'] for joint in robot['joint_states'].values()] for robot in status.values()], dtype=np.float32)
+    joint_velocities = np.array([[joint['velocity'] for joint in robot['joint_states'].values()] for robot in status.values()], dtype=np.float32)
+    return pipette_positions, joint_torques, joint_velocities
+
+
+@register_reward("negative_distance")
+def negative_distance(observations, previous_observations, joint_torques, joint_velocities, distance_threshold):
+    # Iteration 1: the negative distance to the goal
+    distance = goal_distance(observations)
+    return -distance, distance
+
+
+@register_reward("shaped_distance")
+def shaped_distance(observations, previous_observations, joint_torques, joint_velocities, distance_threshold):
+    # Iteration 2: distance penalty, a small torque penalty and a stepwise bonus close to the goal
+    distance = goal_distance(observations)
+    torque_penalty = np.abs(joint_torques).sum(axis=1) * 0.001
+    goal_bonus = np.where(distance < distance_threshold, 10.0, np.where(distance < 0.2, 5.0, 0.0))
+    return -distance * 2 - torque_penalty + goal_bonus, distance
+
+
+@register_reward("progress")
+def progress(observations, previous_observations, joint_torques, joint_velocities, distance_threshold):
+    # Current reward: how much closer the pipette got to the goal during the step
+    distance = goal_distance(observations)
+    return goal_distance(previous_observations) - distance, distance
+
+
+@register_reward("sparse")
+def sparse(observations, previous_observations, joint_torques, joint_velocities, distance_threshold):
+    # -1 for every step the goal has not been reached, 0 once it has
+    distance = goal_distance(observations)
+    return -(distance > distance_threshold).astype(np.float32), distance
@@ -8,18 +8,37 @@ import random
 
 #logging.basicConfig(level=logging.INFO)
 
+# collision filter group of the base plane, the agents use the lower 4 bits
+PLANE_COLLISION_GROUP = 1 << 4
+
+# minimum and maximum of the working envelope of the pipette, gotten from task 9
+ENVELOPE_LOW = [-0.17, -0.16, 0.16]
+ENVELOPE_HIGH = [0.24, 0.21, 0.28]
+
 class Simulation:
-    def __init__(self, num_agents, render=True, rgb_array=False):
+    def __init__(self, num_agents, render=True, rgb_array=False, large_scale=False, sleep_idle_agents=False):
         self.render = render
         self.rgb_array = rgb_array
+        # in large scale mode bodies of different agents are never paired in the broadphase, see create_robots
+        self.large_scale = large_scale
+        # put agents that stand still without droplets in flight to sleep, see update_sleeping
+        self.sleep_idle_agents = sleep_idle_agents
+        # an agent is idle when its joints move slower than this for idle_steps_to_sleep steps in a row
+        self.idle_velocity = 1e-3
+        self.idle_steps_to_sleep = 10
+        # the robotIds of the sleeping agents, their number of idle steps and their states from when they fell asleep
+        self.sleeping = set()
+        self.idle_steps = {}
+        self.sleeping_states = {}
         if render:
             mode = p.GUI # for graphical version
         else:
             mode = p.DIRECT # for non-graphical version
         # Set up the simulation
         self.physicsClient = p.connect(mode)
-        # Hide the default GUI components
-        p.configureDebugVisualizer(p.COV_ENABLE_GUI, 0)
+        if render:
+            # Hide the default GUI components
+            p.configureDebugVisualizer(p.COV_ENABLE_GUI, 0)
         p.setAdditionalSearchPath(pybullet_data.getDataPath()) #optionally
         p.setGravity(0,0,-10)
         #p.setPhysicsEngineParameter(contactBreakingThreshold=0.000001)
@@ -31,16 +50,21 @@ class Simulation:
         self.textureId = p.loadTexture(f'textures/{random_texture}')
         #print(f'textureId: {self.textureId}')
 
-        # Set the camera parameters
-        cameraDistance = 1.1*(math.ceil((num_agents)**0.3)) # Distance from the target (zoom)
-        cameraYaw = 90  # Rotation around the vertical axis in degrees
-        cameraPitch = -35  # Rotation around the horizontal axis in degrees
-        cameraTargetPosition = [-0.2, -(math.ceil(num_agents**0.5)/2)+0.5, 0.1]  # XYZ coordinates of the target position
+        # The debug camera only exists in the GUI, headless simulations skip framing it
+        if render:
+            # Set the camera parameters
+            cameraDistance = 1.1*(math.ceil((num_agents)**0.3)) # Distance from the target (zoom)
+            cameraYaw = 90  # Rotation around the vertical axis in degrees
+            cameraPitch = -35  # Rotation around the horizontal axis in degrees
+            cameraTargetPosition = [-0.2, -(math.ceil(num_agents**0.5)/2)+0.5, 0.1]  # XYZ coordinates of the target position
 
-        # Reset the camera with the specified parameters
-        p.resetDebugVisualizerCamera(cameraDistance, cameraYaw, cameraPitch, cameraTargetPosition)
+            # Reset the camera with the specified parameters
+            p.resetDebugVisualizerCamera(cameraDistance, cameraYaw, cameraPitch, cameraTargetPosition)
 
         self.baseplaneId = p.loadURDF("plane.urdf")
+        if large_scale:
+            # The plane only needs to collide with droplets, the robots and specimens are held in place by constraints
+            p.setCollisionFilterGroupMask(self.baseplaneId, -1, PLANE_COLLISION_GROUP, 0b1111)
         # add collision shape to the plane
         #p.createCollisionShape(shapeType=p.GEOM_BOX, halfExtents=[30, 305, 0.001])
 
@@ -48,16 +72,31 @@ class Simulation:
         self.pipette_offset = [0.073, 0.0895, 0.0895]
         # dictionary to keep track of the current pipette position per robot
         self.pipette_positions = {}
+        # dictionary to keep track of the collision filter group per robot in large scale mode
+        self.collision_groups = {}
 
         # Create the robots
         self.create_robots(num_agents)
 
-        # list of sphere ids
+        # list of sphere ids of the droplets that are still falling
         self.sphereIds = []
+        # dictionaries to find the falling droplets of a robot and the robot a droplet belongs to
+        self.robot_sphereIds = {robotId: [] for robotId in self.robotIds}
+        self.sphere_owners = {}
+        # visual-only bodies that show the droplets that have landed, per robot
+        self.landed_dropletIds = {robotId: [] for robotId in self.robotIds}
+
+        # the droplet shapes are created once and shared by every droplet
+        self.droplet_radius = 0.003
+        self.droplet_visual_shape = None
+        self.droplet_collision_shape = None
 
         # dictionary to keep track of the droplet positions on specimens key for specimenId, list of droplet positions
         self.droplet_positions = {}
 
+        # in-memory snapshot of the freshly built scene, used by reset to avoid rebuilding it
+        self.initial_state = p.saveState()
+
         # Function to compute view matrix based on these parameters
         # def compute_camera_view(cameraDistance, cameraYaw, cameraPitch, cameraTargetPosition):
         #     camUpVector = (0, 0, 1)  # Up vector in Z-direction
@@ -137,6 +176,9 @@ class Simulation:
                     #textureId = p.loadTexture("uvmapped_dish_large_comp.png")
                     p.changeVisualShape(planeId, -1, textureUniqueId=self.textureId)
 
+                    if self.large_scale:
+                        self.set_collision_group(robotId, planeId, i, j)
+
                     self.robotIds.append(robotId)
                     self.specimenIds.append(planeId)
 
@@ -147,6 +189,17 @@ class Simulation:
                     # save the pipette position
                     self.pipette_positions[f'robotId_{robotId}'] = pipette_position
 
+    # method to put the bodies of the agent at grid cell i, j in a collision group
+    # Only 4 groups are needed: neighbouring cells (also diagonally) always get different groups, and agents further apart are too far away
+    # to ever overlap in the broadphase. The robot and specimen only collide with their own group, so robots never pair with each other
+    # or with the plane, and the droplets of an agent (see drop) only pair with their own agent and the plane.
+    def set_collision_group(self, robotId, specimenId, i, j):
+        group = 1 << (2 * (i % 2) + (j % 2))
+        for linkIndex in range(-1, p.getNumJoints(robotId)):
+            p.setCollisionFilterGroupMask(robotId, linkIndex, group, group)
+        p.setCollisionFilterGroupMask(specimenId, -1, group, group)
+        self.collision_groups[robotId] = group
+
     # method to get the current pipette position for a robot
     def get_pipette_position(self, robotId):
         #get the position of the robot
@@ -166,6 +219,30 @@ class Simulation:
 
     # method to reset the simulation
     def reset(self, num_agents=1):
+        # Wake up all agents, the reset starts them moving again
+        for robotId in list(self.sleeping):
+            self.wake_agent(robotId)
+        self.idle_steps = {}
+
+        # Remove the spheres, both the falling ones and the landed visuals
+        for sphereId in self.sphereIds + [landedId for landedIds in self.landed_dropletIds.values() for landedId in landedIds]:
+            p.removeBody(sphereId)
+
+        # list of sphere ids
+        self.sphereIds = []
+        self.robot_sphereIds = {robotId: [] for robotId in self.robotIds}
+        self.sphere_owners = {}
+        self.landed_dropletIds = {robotId: [] for robotId in self.robotIds}
+        # dictionary to keep track of the droplet positions on specimens key for specimenId, list of droplet positions
+        self.droplet_positions = {}
+
+        # With the same number of agents the scene does not have to be rebuilt, restoring the snapshot taken right after it was built
+        # puts every robot back in its start state without loading the URDFs again
+        if num_agents == len(self.robotIds):
+            p.restoreState(stateId=self.initial_state)
+            self.pipette_positions = {f'robotId_{robotId}': self.get_pipette_position(robotId) for robotId in self.robotIds}
+            return self.get_states()
+
         # Remove the textures from the specimens
         for specimenId in self.specimenIds:
             p.changeVisualShape(specimenId, -1, textureUniqueId=-1)
@@ -173,30 +250,23 @@ class Simulation:
         # Remove the robots
         for robotId in self.robotIds:
             p.removeBody(robotId)
-            # remove the robotId from the list of robotIds
-            self.robotIds.remove(robotId)
 
         # Remove the specimens
         for specimenId in self.specimenIds:
             p.removeBody(specimenId)
-            # remove the specimenId from the list of specimenIds
-            self.specimenIds.remove(specimenId)
-
-        # Remove the spheres
-        for sphereId in self.sphereIds:
-            p.removeBody(sphereId)
-            # remove the sphereId from the list of sphereIds
-            self.sphereIds.remove(sphereId)
 
         # dictionary to keep track of the current pipette position per robot
         self.pipette_positions = {}
-        # list of sphere ids
-        self.sphereIds = []
-        # dictionary to keep track of the droplet positions on specimens key for specimenId, list of droplet positions
-        self.droplet_positions = {}
+        self.collision_groups = {}
 
         # Create the robots
         self.create_robots(num_agents)
+        self.robot_sphereIds = {robotId: [] for robotId in self.robotIds}
+        self.landed_dropletIds = {robotId: [] for robotId in self.robotIds}
+
+        # Replace the snapshot with one of the new scene
+        p.removeState(self.initial_state)
+        self.initial_state = p.saveState()
 
         return self.get_states()
 
@@ -230,9 +300,15 @@ class Simulation:
                 #     print(f'robot {i} link_state: {link_state}')
             # check contact for each robot and specimen
             for specimenId, robotId in zip(self.specimenIds, self.robotIds):
+                # sleeping agents have no droplets in flight, so there is nothing to check
+                if robotId in self.sleeping:
+                    continue
                 #logging.info(f'checking contact for robotId: {robotId}, specimenId: {specimenId}')
                 self.check_contact(robotId, specimenId)
 
+            if self.sleep_idle_agents:
+                self.update_sleeping(actions)
+
             if self.rgb_array:
                 # Camera parameters
                 camera_pos = [1, 0, 1] # Example position
@@ -255,6 +331,11 @@ class Simulation:
     # method to apply actions to the robots using velocity control
     def apply_actions(self, actions): # actions [[x,y,z,drop], [x,y,z,drop], ...
         for i in range(len(self.robotIds)):
+            if self.robotIds[i] in self.sleeping:
+                # a sleeping agent keeps sleeping while it gets no new action, its motors are already set to stand still
+                if not any(actions[i]):
+                    continue
+                self.wake_agent(self.robotIds[i])
             p.setJointMotorControl2(self.robotIds[i], 0, p.VELOCITY_CONTROL, targetVelocity=-actions[i][0], force=500)
             p.setJointMotorControl2(self.robotIds[i], 1, p.VELOCITY_CONTROL, targetVelocity=-actions[i][1], force=500)
             p.setJointMotorControl2(self.robotIds[i], 2, p.VELOCITY_CONTROL, targetVelocity=actions[i][2], force=800)
@@ -281,66 +362,147 @@ class Simulation:
         specimen_position = p.getBasePositionAndOrientation(self.specimenIds[0])[0]
         #logging.info(f'droplet_position: {droplet_position}')
         # Create a sphere to represent the droplet
-        sphereRadius = 0.003  # Adjust as needed
-        sphereColor = [1, 0, 0, 0.5]  # RGBA (Red in this case)
-        visualShapeId = p.createVisualShape(shapeType=p.GEOM_SPHERE, radius=sphereRadius, rgbaColor=sphereColor)
-        #add collision to the sphere
-        collision = p.createCollisionShape(shapeType=p.GEOM_SPHERE, radius=sphereRadius)
-        sphereBody = p.createMultiBody(baseMass=0.1, baseVisualShapeIndex=visualShapeId, baseCollisionShapeIndex=collision)
+        self.create_droplet_shapes()
+        sphereBody = p.createMultiBody(baseMass=0.1, baseVisualShapeIndex=self.droplet_visual_shape, baseCollisionShapeIndex=self.droplet_collision_shape)
         # Calculate the position of the droplet at the tip of the pipette but at the same z coordinate as the specimen
         droplet_position = [robot_position[0]+x_offset, robot_position[1]+y_offset, robot_position[2]+z_offset]
                             #specimen_position[2] + sphereRadius+0.015/2+0.06]
         p.resetBasePositionAndOrientation(sphereBody, droplet_position, [0, 0, 0, 1])
+        if self.large_scale:
+            group = self.collision_groups[robotId]
+            p.setCollisionFilterGroupMask(sphereBody, -1, group, group | PLANE_COLLISION_GROUP)
         # track the sphere id
         self.sphereIds.append(sphereBody)
+        self.robot_sphereIds[robotId].append(sphereBody)
+        self.sphere_owners[sphereBody] = robotId
         self.dropped = True
         #TODO: add some randomness to the droplet position proportional to the height of the pipette above the specimen and the velocity of the pipette of the pipette
         return droplet_position
 
+    # method to create the droplet shapes the first time a droplet is needed, every droplet reuses them
+    def create_droplet_shapes(self):
+        if self.droplet_visual_shape is None:
+            sphereColor = [1, 0, 0, 0.5]  # RGBA (Red in this case)
+            self.droplet_visual_shape = p.createVisualShape(shapeType=p.GEOM_SPHERE, radius=self.droplet_radius, rgbaColor=sphereColor)
+            #add collision to the sphere
+            self.droplet_collision_shape = p.createCollisionShape(shapeType=p.GEOM_SPHERE, radius=self.droplet_radius)
+
+    # method to take a landed droplet out of the physics world, only a visual-only body without collision or mass is left behind
+    # when the simulation is rendered, so the cost of a step does not grow with the number of droplets dispensed
+    def retire_droplet(self, sphereId, position, orientation):
+        robotId = self.sphere_owners[sphereId]
+        self.remove_droplet(sphereId)
+        if self.render or self.rgb_array:
+            self.add_droplet_visual(robotId, position, orientation)
+
+    # method to show a landed droplet of a robot at position with a visual-only body
+    def add_droplet_visual(self, robotId, position, orientation=(0, 0, 0, 1)):
+        self.create_droplet_shapes()
+        landedId = p.createMultiBody(baseMass=0, baseVisualShapeIndex=self.droplet_visual_shape, baseCollisionShapeIndex=-1,
+                                     basePosition=position, baseOrientation=orientation)
+        self.landed_dropletIds[robotId].append(landedId)
+        return landedId
+
+    # method to remove a falling droplet from the physics world and from the lists that track it
+    def remove_droplet(self, sphereId):
+        p.removeBody(sphereId)
+        self.sphereIds.remove(sphereId)
+        self.robot_sphereIds[self.sphere_owners.pop(sphereId)].remove(sphereId)
+
     # method to get the states of the robots
     def get_states(self):
         states = {}
         for robotId in self.robotIds:
-            raw_joint_states = p.getJointStates(robotId, [0, 1, 2])
-
-            # Convert joint states into a dictionary
-            joint_states = {}
-            for i, joint_state in enumerate(raw_joint_states):
-                joint_states[f'joint_{i}'] = {
-                    'position': joint_state[0],
-                    'velocity': joint_state[1],
-                    'reaction_forces': joint_state[2],
-                    'motor_torque': joint_state[3]
-                }
-
-            # Robot position
-            robot_position = p.getBasePositionAndOrientation(robotId)[0]
-            robot_position = list(robot_position)
-
-            # Adjust robot position based on joint states
-            robot_position[0] -= raw_joint_states[0][0]
-            robot_position[1] -= raw_joint_states[1][0]
-            robot_position[2] += raw_joint_states[2][0]
-
-            # Pipette position
-            pipette_position = [robot_position[0] + self.pipette_offset[0],
-                                robot_position[1] + self.pipette_offset[1],
-                                robot_position[2] + self.pipette_offset[2]]
-            # Round pipette position to 4 decimal places
-            pipette_position = [round(num, 4) for num in pipette_position]
-
-            # Store information in the dictionary
-            states[f'robotId_{robotId}'] = {
-                "joint_states": joint_states,
-                "robot_position": robot_position,
-                "pipette_position": pipette_position
-            }
+            # the state of a sleeping agent does not change, it is kept from when it fell asleep
+            if robotId in self.sleeping:
+                states[f'robotId_{robotId}'] = self.sleeping_states[robotId]
+            else:
+                states[f'robotId_{robotId}'] = self.get_robot_state(robotId)
 
         return states
-    
-    # method to check contact with the spheres and the specimen and robot, when contact is detected, the sphere is fixed in place and collision is disabled
+
+    # method to get the state of a single robot
+    def get_robot_state(self, robotId):
+        raw_joint_states = p.getJointStates(robotId, [0, 1, 2])
+
+        # Convert joint states into a dictionary
+        joint_states = {}
+        for i, joint_state in enumerate(raw_joint_states):
+            joint_states[f'joint_{i}'] = {
+                'position': joint_state[0],
+                'velocity': joint_state[1],
+                'reaction_forces': joint_state[2],
+                'motor_torque': joint_state[3]
+            }
+
+        # Robot position
+        robot_position = p.getBasePositionAndOrientation(robotId)[0]
+        robot_position = list(robot_position)
+
+        # Adjust robot position based on joint states
+        robot_position[0] -= raw_joint_states[0][0]
+        robot_position[1] -= raw_joint_states[1][0]
+        robot_position[2] += raw_joint_states[2][0]
+
+        # Pipette position
+        pipette_position = [robot_position[0] + self.pipette_offset[0],
+                            robot_position[1] + self.pipette_offset[1],
+                            robot_position[2] + self.pipette_offset[2]]
+        # Round pipette position to 4 decimal places
+        pipette_position = [round(num, 4) for num in pipette_position]
+
+        # Store information in the dictionary
+        return {
+            "joint_states": joint_states,
+            "robot_position": robot_position,
+            "pipette_position": pipette_position
+        }
+
+    # method to put agents to sleep that got a zero action, stand still and have no droplets in flight
+    # A sleeping robot and its specimen are deactivated in the physics engine and skipped by the loops in run, apply_actions and get_states,
+    # so the cost of a step only depends on the number of active agents. A new non-zero action wakes the agent up again (see apply_actions).
+    def update_sleeping(self, actions):
+        for i, robotId in enumerate(self.robotIds):
+            if robotId in self.sleeping:
+                continue
+            if any(actions[i]) or self.robot_sphereIds[robotId]:
+                self.idle_steps[robotId] = 0
+                continue
+
+            velocities = [joint_state[1] for joint_state in p.getJointStates(robotId, [0, 1, 2])]
+            if max(abs(velocity) for velocity in velocities) < self.idle_velocity:
+                self.idle_steps[robotId] = self.idle_steps.get(robotId, 0) + 1
+            else:
+                self.idle_steps[robotId] = 0
+
+            if self.idle_steps[robotId] >= self.idle_steps_to_sleep:
+                self.sleep_agent(i)
+
+    # method to put the agent at index i to sleep
+    def sleep_agent(self, i):
+        robotId, specimenId = self.robotIds[i], self.specimenIds[i]
+        self.sleeping_states[robotId] = self.get_robot_state(robotId)
+        for bodyId in [robotId, specimenId]:
+            p.changeDynamics(bodyId, -1, activationState=p.ACTIVATION_STATE_ENABLE_SLEEPING)
+            p.changeDynamics(bodyId, -1, activationState=p.ACTIVATION_STATE_SLEEP)
+        self.sleeping.add(robotId)
+
+    # method to wake up a sleeping agent
+    def wake_agent(self, robotId):
+        specimenId = self.specimenIds[self.robotIds.index(robotId)]
+        for bodyId in [robotId, specimenId]:
+            p.changeDynamics(bodyId, -1, activationState=p.ACTIVATION_STATE_WAKE_UP)
+            # the engine should not put the agent to sleep on its own while it is active
+            p.changeDynamics(bodyId, -1, activationState=p.ACTIVATION_STATE_DISABLE_SLEEPING)
+        self.sleeping.discard(robotId)
+        self.sleeping_states.pop(robotId, None)
+        self.idle_steps[robotId] = 0
+
+    # method to check contact with the spheres and the specimen and robot, when contact is detected with the specimen the sphere is
+    # retired from the physics world and its landing position is recorded
     def check_contact(self, robotId, specimenId):
-        for sphereId in self.sphereIds:
+        # only the droplets of this robot can land on its specimen, iterate over a copy as landed and destroyed spheres are removed
+        for sphereId in list(self.robot_sphereIds[robotId]):
             # Check contact with the specimen
             contact_points_specimen = p.getContactPoints(sphereId, specimenId)
             # Check contact with the robot
@@ -349,44 +511,28 @@ class Simulation:
             # If contact with the specimen is detected
             if contact_points_specimen:
                 #logging.info(f'sphereId: {sphereId}, in contact with specimen: {specimenId}')
-                # Disable collision between the sphere and the specimen
-                p.setCollisionFilterPair(sphereId, specimenId, -1, -1, enableCollision=0)
-                #logging.info(f'sphereId: {sphereId}, collision disabled')
                 # Get current position and orientation of the sphere
                 sphere_position, sphere_orientation = p.getBasePositionAndOrientation(sphereId)
-                # Fix the sphere in place relative to the world
-                p.createConstraint(parentBodyUniqueId=sphereId,
-                                    parentLinkIndex=-1,
-                                    childBodyUniqueId=-1,
-                                    childLinkIndex=-1,
-                                    jointType=p.JOINT_FIXED,
-                                    jointAxis=[0, 0, 0],
-                                    parentFramePosition=[0, 0, 0],
-                                    childFramePosition=sphere_position,
-                                    childFrameOrientation=sphere_orientation)
                 # track the final position of the sphere on the specimen by adding it to the dictionary
                 if f'specimenId_{specimenId}' in self.droplet_positions:
                     self.droplet_positions[f'specimenId_{specimenId}'].append(sphere_position)
                 else:
                     self.droplet_positions[f'specimenId_{specimenId}'] = [sphere_position]
 
-                #logging.info(f'sphereId: {sphereId}, fixed in place')
+                # The landed droplet no longer needs to be simulated, this replaces fixing it in place with a constraint
+                self.retire_droplet(sphereId, sphere_position, sphere_orientation)
+                continue
 
-                # # turn off all collisions with other spheres that are in contact with this sphere
-                # for sphereId2 in self.sphereIds:
-                #     if sphereId2 != sphereId:
-                #         contact_points = p.getContactPoints(sphereId, sphereId2)
-                #         if contact_points:
-                #             p.setCollisionFilterPair(sphereId, sphereId2, -1, -1, enableCollision=0)
-                #             logging.info(f'sphereId: {sphereId}, collision disabled with sphereId2: {sphereId2}')
+            # A droplet that missed the specimen and hit the floor is destroyed so it does not stay in the physics world forever
+            if p.getContactPoints(sphereId, self.baseplaneId):
+                self.remove_droplet(sphereId)
+                continue
 
             # If contact with the robot is detected
             if contact_points_robot:
-                # Destroy the sphere
-                p.removeBody(sphereId)
+                # Destroy the sphere and remove it from the lists of sphereIds
+                self.remove_droplet(sphereId)
                 #logging.info(f'sphereId: {sphereId}, removed')
-                # Remove the sphereId from the list of sphereIds
-                self.sphereIds.remove(sphereId)
                 # Disable collision between the sphere and the robot
                 # p.setCollisionFilterPair(sphereId, robotId, -1, -1, enableCollision=0)
                 # Get current position and orientation of the sphere
@@ -414,21 +560,55 @@ class Simulation:
     def set_start_position(self, x, y, z):
         # Iterate through each robot and set its pipette to the start position
         for robotId in self.robotIds:
-            # Calculate the necessary joint positions to reach the desired start position
-            # The calculation depends on the kinematic model of the robot
-            # For simplicity, let's assume a simple model where each joint moves in one axis (x, y, z)
-            # You might need to adjust this based on the actual robot kinematics
-
-            # Adjust the x, y, z values based on the robot's current position and pipette offset
-            robot_position = p.getBasePositionAndOrientation(robotId)[0]
-            adjusted_x = x - robot_position[0] - self.pipette_offset[0]
-            adjusted_y = y - robot_position[1] - self.pipette_offset[1]
-            adjusted_z = z - robot_position[2] - self.pipette_offset[2]
-
-            # Reset the joint positions/start position
-            p.resetJointState(robotId, 0, targetValue=adjusted_x)
-            p.resetJointState(robotId, 1, targetValue=adjusted_y)
-            p.resetJointState(robotId, 2, targetValue=adjusted_z)
+            self.set_pipette_position(robotId, x, y, z)
+
+    # method to teleport the pipette of a single robot to x, y, z by resetting its joints
+    def set_pipette_position(self, robotId, x, y, z):
+        # Calculate the necessary joint positions to reach the desired start position
+        # Each joint moves in one axis, the x and y joints move the pipette in the negative direction (see get_pipette_position)
+
+        # A teleported agent has to be simulated again
+        if robotId in self.sleeping:
+            self.wake_agent(robotId)
+
+        # Adjust the x, y, z values based on the robot's current position and pipette offset
+        robot_position = p.getBasePositionAndOrientation(robotId)[0]
+        adjusted_x = robot_position[0] + self.pipette_offset[0] - x
+        adjusted_y = robot_position[1] + self.pipette_offset[1] - y
+        adjusted_z = z - robot_position[2] - self.pipette_offset[2]
+
+        # Reset the joint positions/start position
+        p.resetJointState(robotId, 0, targetValue=adjusted_x)
+        p.resetJointState(robotId, 1, targetValue=adjusted_y)
+        p.resetJointState(robotId, 2, targetValue=adjusted_z)
+        self.pipette_positions[f'robotId_{robotId}'] = self.get_pipette_position(robotId)
+
+    # method to reset only some of the agents, the other agents keep running undisturbed
+    # indices are positions in self.robotIds, start_positions optionally gives a pipette [x, y, z] per index to teleport to
+    def reset_agents(self, indices, start_positions=None):
+        for n, index in enumerate(indices):
+            robotId = self.robotIds[index]
+            specimenId = self.specimenIds[index]
+            if robotId in self.sleeping:
+                self.wake_agent(robotId)
+
+            # Remove the droplets of this agent, both the falling ones and the landed visuals, and forget where they landed
+            for sphereId in list(self.robot_sphereIds[robotId]):
+                self.remove_droplet(sphereId)
+            for landedId in self.landed_dropletIds[robotId]:
+                p.removeBody(landedId)
+            self.landed_dropletIds[robotId] = []
+            self.droplet_positions.pop(f'specimenId_{specimenId}', None)
+
+            # Put the joints back in their start state and stop them
+            for joint in range(3):
+                p.resetJointState(robotId, joint, targetValue=0, targetVelocity=0)
+            self.pipette_positions[f'robotId_{robotId}'] = self.get_pipette_position(robotId)
+
+            if start_positions is not None:
+                self.set_pipette_position(robotId, *start_positions[n])
+
+        return self.get_states()
 
     # function to return the path of the current plate image
     def get_plate_image(self):
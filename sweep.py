@@ -0,0 +1,264 @@
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing as mp
+import os
+import queue
+import statistics
+import time
+
+from stable_baselines3.common.callbacks import BaseCallback
+
+# Callbacks that can be switched on per trial, referenced by name in the search space
+CALLBACKS = {
+    "reward_shaping": "RewardShapingCallback",
+    "adaptive_threshold": "AdaptiveThresholdCallback",
+    "curriculum": "CurriculumCallback",
+}
+
+# The sweep that used to live commented out in training.py
+DEFAULT_SEARCH_SPACE = {
+    "n_steps": [1024, 2048],
+    "callbacks": [["reward_shaping"], ["adaptive_threshold"], ["reward_shaping", "adaptive_threshold"]],
+}
+
+
+def expand_search_space(search_space):
+    """Expands a grid search space into a list of trial configurations.
+
+    Args:
+        search_space (dict): Maps a PPO argument (or "callbacks") to the list of values to try.
+
+    Returns:
+        List[dict]: Every combination of the given values.
+    """
+    keys = list(search_space.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*(search_space[key] for key in keys))]
+
+
+def allocate_cores(cores_per_trial):
+    """Splits the cores this process may run on into equally sized slots, one per concurrent trial.
+
+    Args:
+        cores_per_trial (int): Number of cores each trial gets pinned to.
+
+    Returns:
+        List[List[int]]: The core ids of each slot.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    cores_per_trial = max(1, min(cores_per_trial, len(cores)))
+    return [cores[i:i + cores_per_trial] for i in range(0, len(cores) - cores_per_trial + 1, cores_per_trial)]
+
+
+def best_reward(curve):
+    """The best reward of a learning curve, skipping reports without finished episodes."""
+    rewards = [reward for reward in curve if reward is not None]
+    return max(rewards) if rewards else None
+
+
+class MedianPruningCallback(BaseCallback):
+    """Stops a trial whose mean episode reward falls below the median of the other trials at the same report.
+
+    Every report_freq timesteps the mean reward of the recent episodes is written to a dictionary shared between
+    all trials of the sweep. Once warmup_reports have been made and at least min_trials other trials have reached
+    the same report, the trial is stopped when its best reward so far is below their median.
+    """
+    def __init__(self, trial_id, reports, report_freq=20000, warmup_reports=3, min_trials=2, verbose=0):
+        super(MedianPruningCallback, self).__init__(verbose)
+        self.trial_id = trial_id
+        self.reports = reports
+        self.report_freq = report_freq
+        self.warmup_reports = warmup_reports
+        self.min_trials = min_trials
+        self.curve = []
+        self.pruned = False
+        self.next_report = report_freq
+
+    def mean_episode_reward(self):
+        if len(self.model.ep_info_buffer) == 0:
+            return None
+        return sum(info["r"] for info in self.model.ep_info_buffer) / len(self.model.ep_info_buffer)
+
+    def _on_step(self) -> bool:
+        if self.num_timesteps < self.next_report:
+            return True
+        self.next_report += self.report_freq
+
+        # Reports are indexed by timestep, so report k of every trial is taken after the same amount of training.
+        # Reports without finished episodes are kept as None to keep the indices aligned.
+        report = self.num_timesteps // self.report_freq - 1
+        self.curve.extend([None] * (report + 1 - len(self.curve)))
+        reward = self.mean_episode_reward()
+        if reward is None:
+            return True
+        self.curve[report] = reward
+        # Reassign instead of appending so the manager proxy picks up the change
+        self.reports[self.trial_id] = list(self.curve)
+
+        if report < self.warmup_reports:
+            return True
+
+        others = [best_reward(curve[:report + 1]) for trial_id, curve in self.reports.items()
+                  if trial_id != self.trial_id and len(curve) > report]
+        others = [reward for reward in others if reward is not None]
+        if len(others) < self.min_trials:
+            return True
+
+        if best_reward(self.curve) < statistics.median(others):
+            if self.verbose > 0:
+                print(f"Pruning trial {self.trial_id} at {self.num_timesteps} timesteps")
+            self.pruned = True
+            return False
+        return True
+
+
+def run_trial(trial_id, config, cores, reports, results, args):
+    """Trains a single PPO model for a trial configuration, pinned to the given cores.
+
+    Runs in its own process. The outcome is put on the results queue as a row of the sweep table.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        # Env workers started below inherit the affinity of this process
+        os.sched_setaffinity(0, cores)
+
+    import torch
+    from stable_baselines3 import PPO
+    from stable_baselines3.common.env_util import make_vec_env
+    from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+    import ot2_gym_wrapper
+    from ot2_gym_wrapper import OT2_wrapper
+
+    # One core per env worker, the policy update gets a single thread so it does not fight the workers
+    torch.set_num_threads(1)
+    n_envs = len(cores)
+
+    row = {"trial": trial_id, "cores": " ".join(str(core) for core in cores), "n_envs": n_envs}
+    row.update({key: json.dumps(value) if isinstance(value, list) else value for key, value in config.items()})
+
+    start = time.time()
+    env = None
+    try:
+        env = make_vec_env(OT2_wrapper, n_envs=n_envs, seed=args.seed + trial_id,
+                           env_kwargs={"max_steps": args.max_steps},
+                           vec_env_cls=SubprocVecEnv if n_envs > 1 else DummyVecEnv)
+
+        ppo_kwargs = {key: value for key, value in config.items() if key != "callbacks"}
+        # n_steps is the rollout length per env, keep the rollout size per update the same as with one env
+        if "n_steps" in ppo_kwargs:
+            ppo_kwargs["n_steps"] = max(1, ppo_kwargs["n_steps"] // n_envs)
+        model = PPO("MlpPolicy", env, verbose=0, seed=args.seed + trial_id,
+                    tensorboard_log=os.path.join(args.output, "runs"), **ppo_kwargs)
+
+        pruning = MedianPruningCallback(trial_id, reports, report_freq=args.report_freq,
+                                        warmup_reports=args.warmup_reports, min_trials=args.min_trials, verbose=1)
+        callbacks = [getattr(ot2_gym_wrapper, CALLBACKS[name])() for name in config.get("callbacks", [])]
+
+        model.learn(total_timesteps=args.total_timesteps, callback=callbacks + [pruning],
+                    tb_log_name=f"trial_{trial_id}")
+        model.save(os.path.join(args.output, "models", f"trial_{trial_id}"))
+
+        row["status"] = "pruned" if pruning.pruned else "complete"
+        row["timesteps"] = model.num_timesteps
+        row["final_reward"] = pruning.mean_episode_reward()
+        row["best_reward"] = best_reward(pruning.curve)
+    except Exception as e:
+        row["status"] = f"failed: {e}"
+    finally:
+        if env is not None:
+            env.close()
+
+    row["wall_time"] = round(time.time() - start, 1)
+    results.put(row)
+
+
+def run_sweep(search_space, args):
+    """Runs every configuration of the search space, as many at once as there are core slots.
+
+    Returns:
+        List[dict]: One row per trial, sorted by best reward.
+    """
+    configs = expand_search_space(search_space)
+    slots = allocate_cores(args.cores_per_trial)
+    print(f"Running {len(configs)} trials, {len(slots)} at a time on {len(slots[0])} cores each")
+
+    os.makedirs(args.output, exist_ok=True)
+    # Spawn so every trial starts with a fresh pybullet and torch state
+    ctx = mp.get_context("spawn")
+    manager = ctx.Manager()
+    reports = manager.dict()
+    results = ctx.Queue()
+
+    pending = list(enumerate(configs))
+    running = {}  # slot index -> (trial id, process)
+    rows = []
+    while pending or running:
+        # Start a trial on every free slot
+        for slot, cores in enumerate(slots):
+            if slot not in running and pending:
+                trial_id, config = pending.pop(0)
+                process = ctx.Process(target=run_trial, args=(trial_id, config, cores, reports, results, args))
+                process.start()
+                running[slot] = (trial_id, process)
+
+        try:
+            row = results.get(timeout=5)
+        except queue.Empty:
+            # A trial that died without reporting (e.g. a crash inside pybullet) still frees its slot
+            for slot, (trial_id, process) in list(running.items()):
+                if not process.is_alive():
+                    rows.append({"trial": trial_id, "status": f"failed: exit code {process.exitcode}"})
+                    del running[slot]
+            continue
+
+        rows.append(row)
+        print(f"Trial {row['trial']} finished: {row['status']}")
+        for slot, (trial_id, process) in list(running.items()):
+            if trial_id == row["trial"]:
+                process.join()
+                del running[slot]
+
+    manager.shutdown()
+    rows.sort(key=lambda row: row.get("best_reward") if row.get("best_reward") is not None else float("-inf"),
+              reverse=True)
+    write_results(rows, os.path.join(args.output, "results.csv"))
+    return rows
+
+
+def write_results(rows, path):
+    # Trials can have different search space keys, so the columns are the union of all rows
+    columns = []
+    for row in rows:
+        columns += [key for key in row if key not in columns]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local parallel hyperparameter sweep for the OT2 env")
+    parser.add_argument("--search_space", type=str, default=None,
+                        help="JSON file mapping PPO arguments (and 'callbacks') to lists of values")
+    parser.add_argument("--output", type=str, default="sweeps/sweep")
+    parser.add_argument("--cores_per_trial", type=int, default=4)
+    parser.add_argument("--total_timesteps", type=int, default=5000000)
+    parser.add_argument("--max_steps", type=int, default=1000)
+    parser.add_argument("--report_freq", type=int, default=20000)
+    parser.add_argument("--warmup_reports", type=int, default=3)
+    parser.add_argument("--min_trials", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.search_space is not None:
+        with open(args.search_space) as f:
+            search_space = json.load(f)
+    else:
+        search_space = DEFAULT_SEARCH_SPACE
+
+    for row in run_sweep(search_space, args):
+        print(row)
@@ -0,0 +1,53 @@
+from ot2_gym_wrapper import OT2GoalEnv
+from stable_baselines3 import SAC, TD3
+from stable_baselines3.her.her_replay_buffer import HerReplayBuffer
+from stable_baselines3.common.logger import Logger, HumanOutputFormat
+import sys
+import argparse
+import secrets
+from checkpointing import AsyncCheckpointCallback
+from metrics import MetricsSink, SinkOutputFormat, MetricsCallback
+
+# Off-policy training with hindsight goal relabeling. Unlike PPO in training.py every transition is kept in a replay
+# buffer, and trajectories that missed their goal are replayed as successes for the positions the pipette did reach.
+
+ALGORITHMS = {"sac": SAC, "td3": TD3}
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--algorithm", choices=list(ALGORITHMS), default="sac")
+parser.add_argument("--learning_rate", type=float, default=0.0003)
+parser.add_argument("--batch_size", type=int, default=256)
+parser.add_argument("--buffer_size", type=int, default=1000000)
+parser.add_argument("--learning_starts", type=int, default=1000)
+parser.add_argument("--n_sampled_goal", type=int, default=4)
+parser.add_argument("--goal_selection_strategy", choices=["future", "final", "episode"], default="future")
+parser.add_argument("--reward", type=str, default="sparse", help="a reward from rewards.py that only depends on the goal distance")
+parser.add_argument("--max_steps", type=int, default=1000)
+parser.add_argument("--total_timesteps", type=int, default=1000000)
+parser.add_argument("--run_id", type=str, default=None, help="defaults to a random id")
+
+args = parser.parse_args()
+
+run_id = args.run_id or secrets.token_hex(4)
+
+env = OT2GoalEnv(max_steps=args.max_steps, reward=args.reward)
+model = ALGORITHMS[args.algorithm]('MultiInputPolicy', env, verbose=1,
+                                   learning_rate=args.learning_rate,
+                                   batch_size=args.batch_size,
+                                   buffer_size=args.buffer_size,
+                                   learning_starts=args.learning_starts,
+                                   replay_buffer_class=HerReplayBuffer,
+                                   replay_buffer_kwargs=dict(n_sampled_goal=args.n_sampled_goal,
+                                                             goal_selection_strategy=args.goal_selection_strategy))
+
+# metrics are buffered in memory and written to runs/<run id>/metrics.jsonl in the background
+metrics_sink = MetricsSink(f"runs/{run_id}")
+model.set_logger(Logger(folder=None, output_formats=[HumanOutputFormat(sys.stdout), SinkOutputFormat(metrics_sink)]))
+metrics_callback = MetricsCallback(metrics_sink)
+
+# snapshot the model every 20000 steps and write it to models/<run id> in the background
+checkpoint_callback = AsyncCheckpointCallback(save_freq=20000, save_path=f"models/{run_id}", keep_last=3, verbose=1)
+
+model.learn(total_timesteps=args.total_timesteps, callback=[metrics_callback, checkpoint_callback], progress_bar=True)
+
+metrics_sink.close()
@@ -1,107 +1,57 @@
-import wandb
-from wandb.integration.sb3 import WandbCallback
 from ot2_gym_wrapper import OT2_wrapper, RewardShapingCallback, AdaptiveThresholdCallback, CurriculumCallback
 from stable_baselines3 import PPO
-import os
+import sys
 import argparse
-from clearml import Task
+import secrets
 from typing_extensions import TypeIs
 import tensorflow
 from stable_baselines3.common.callbacks import CallbackList
-from itertools import product
+from stable_baselines3.common.logger import Logger, HumanOutputFormat
+from checkpointing import AsyncCheckpointCallback
+from metrics import MetricsSink, SinkOutputFormat, MetricsCallback
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--learning_rate", type=float, default=0.0003)
 parser.add_argument("--batch_size", type=int, default=64)
 parser.add_argument("--n_steps", type=int, default=2048)
 parser.add_argument("--n_epochs", type=int, default=10)
+parser.add_argument("--run_id", type=str, default=None, help="defaults to a random id")
+parser.add_argument("--remote", action="store_true", help="run on the ClearML queue instead of locally")
 
 args = parser.parse_args()
 
-task = Task.init(project_name='Mentor Group J/Group 3', # NB: Replace YourName with your own name
-                     task_name='adjusted bounds')
+if args.remote:
+    from clearml import Task
 
-task.set_base_docker('deanis/2023y2b-rl:latest')
+    task = Task.init(project_name='Mentor Group J/Group 3', # NB: Replace YourName with your own name
+                         task_name='adjusted bounds')
 
-task.execute_remotely(queue_name="default")
+    task.set_base_docker('deanis/2023y2b-rl:latest')
 
-os.environ['WANDB_API_KEY'] = '118175988af2b259ce56714ba8a38955d33c1939'
+    task.execute_remotely(queue_name="default")
+
+run_id = args.run_id or secrets.token_hex(4)
 
 env = OT2_wrapper(max_steps=1000)
 model = PPO('MlpPolicy', env, verbose=1)
 
-# initialize wandb project
-run = wandb.init(project="test",sync_tensorboard=True) # sb3_OT2
+# metrics are buffered in memory and written to runs/<run id>/metrics.jsonl in the background, no network needed
+# convert them afterwards with: python metrics.py export runs/<run id> --format tensorboard
+metrics_sink = MetricsSink(f"runs/{run_id}")
+model.set_logger(Logger(folder=None, output_formats=[HumanOutputFormat(sys.stdout), SinkOutputFormat(metrics_sink)]))
+metrics_callback = MetricsCallback(metrics_sink)
 
-#create wandb callback
-wandb_callback = WandbCallback(model_save_freq=20000,
-                                model_save_path=f"models/{run.id}",
-                                verbose=2,
-                                )
+# snapshot the model every 20000 steps and write it to models/<run id> in the background
+checkpoint_callback = AsyncCheckpointCallback(save_freq=20000, save_path=f"models/{run_id}", keep_last=3, verbose=1)
 
 dynamic_distance_reward = RewardShapingCallback()
 dynamic_speed_reward = AdaptiveThresholdCallback()
 curriculum_callback = CurriculumCallback()
 
-model.learn(total_timesteps=5000000, callback=[dynamic_distance_reward, curriculum_callback, wandb_callback], 
-            progress_bar=True, reset_num_timesteps=False, 
-            tb_log_name=f"runs/{run.id}")
-
-# Define the possible values for n_steps
-#n_steps_values = [1024, 2048]
-
-# # Define the list of callbacks (excluding wandb_callback as it's always added)
-# callbacks = [dynamic_distance_reward, dynamic_speed_reward, [dynamic_distance_reward, dynamic_speed_reward]]
-
-# # Create all combinations of callbacks and n_steps values
-# callback_combinations = list(product(callbacks, n_steps_values))
-# print(len(callback_combinations))
-
-# # Loop through all combinations of callbacks and n_steps
-# for cb, n_steps in callback_combinations:
-#     # Initialize a new wandb run for each combination
-#     run = wandb.init(project="sb3_OT2", sync_tensorboard=True, reinit=True)  # reinit=True creates a new run
-
-#     if not os.path.exists(f"models/{run.id}"):
-#         os.makedirs(f"models/{run.id}")
-
-#     # Add the W&B callback explicitly for each combination
-#     wandb_callback = WandbCallback(model_save_freq=200000,
-#                                     model_save_path=f"models/{run.id}",
-#                                     verbose=2,
-#                                     )
-        
-#     if isinstance(cb, list):
-#         current_callbacks = cb + [wandb_callback]  # Add wandb callback explicitly
-#     else:
-#         current_callbacks = [cb, wandb_callback] # Add wandb callback explicitly
-
-#     # Initialize the model with the current n_steps value
-#     model = PPO('MlpPolicy', env, verbose=1, 
-#                 learning_rate=args.learning_rate, 
-#                 batch_size=args.batch_size, 
-#                 n_steps=n_steps,  # Set n_steps from the combination
-#                 n_epochs=args.n_epochs, 
-#                 tensorboard_log=f"runs/{run.id}",)
-
-#     # Log the callback configuration to WandB
-#     callback_names = [type(cb).__name__ for cb in current_callbacks]
-
-#     # Log the number of steps
-#     wandb.log({"n_steps": n_steps})
-
-#     # Create the table with rows as lists of callback names
-#     callback_table = wandb.Table(columns=["Callbacks used"], data=[[cb] for cb in callback_names])
-
-#     # Log the table
-#     wandb.log({"callbacks_table": callback_table})
-
-#     # Train the model
-#     model.learn(total_timesteps=5000000, callback=current_callbacks, 
-#                 progress_bar=True, reset_num_timesteps=False, 
-#                 tb_log_name=f"runs/{run.id}")
+model.learn(total_timesteps=5000000, callback=[dynamic_distance_reward, curriculum_callback, metrics_callback, checkpoint_callback], 
+            progress_bar=True, reset_num_timesteps=False)
 
-#     # Finish the run
-#     wandb.finish()
+metrics_sink.close()
 
-        
\ No newline at end of file
+# Hyperparameter sweeps over n_steps and the callbacks above run locally and in parallel with sweep.py:
+# python sweep.py --cores_per_trial 4 --output sweeps/n_steps_callbacks
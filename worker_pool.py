@@ -0,0 +1,79 @@
+import multiprocessing as mp
+import os
+import random
+
+import numpy as np
+import pybullet as p
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import SubprocVecEnv
+
+from ot2_gym_wrapper import OT2_wrapper
+from sim_class import Simulation
+
+
+def make_prefork_vec_env(n_envs, env_kwargs=None, seed=None):
+    """Creates a SubprocVecEnv of OT2_wrapper envs whose workers are forked from one pre-built scene.
+
+    The OT2 scene (plane, texture, robot and specimen URDFs, constraints) is built once in a p.DIRECT simulation in
+    this process. The workers are then forked, so each inherits a copy-on-write copy of the physics world instead
+    of connecting and loading everything itself. Spawning many workers then takes about as long as spawning one,
+    and the pages of the world that are never written (meshes, shapes) stay shared between workers.
+
+    All workers share the plate texture picked in the parent. Create the pool before the model, since forking a
+    process that has already started torch threads can deadlock.
+
+    On platforms without fork every worker builds its own simulation, like a plain SubprocVecEnv.
+
+    Args:
+        n_envs (int): Number of worker processes.
+        env_kwargs (dict, optional): Extra arguments for OT2_wrapper. Defaults to None.
+        seed (int, optional): Seeds the workers with seed + rank, otherwise they are seeded from os entropy.
+
+    Returns:
+        SubprocVecEnv: The vectorized env, every env wrapped in a Monitor.
+    """
+    env_kwargs = env_kwargs or {}
+    if "render" in env_kwargs and env_kwargs["render"]:
+        raise ValueError("The pre-forked worker pool only supports headless simulations")
+
+    can_fork = "fork" in mp.get_all_start_methods()
+    # Build the scene once, the forked workers inherit it
+    sim = Simulation(num_agents=1, render=False) if can_fork else None
+
+    def make_env(rank):
+        def _init():
+            # The random state is copied on fork, without reseeding every worker would draw the same goals
+            worker_seed = None if seed is None else seed + rank
+            random.seed(worker_seed)
+            np.random.seed(worker_seed)
+            return Monitor(OT2_wrapper(sim=sim, **env_kwargs))
+        return _init
+
+    vec_env = SubprocVecEnv([make_env(rank) for rank in range(n_envs)], start_method="fork" if can_fork else None)
+
+    if sim is not None:
+        # The workers have their own copy of the world now, the parent does not need its copy anymore
+        p.disconnect(sim.physicsClient)
+    return vec_env
+
+
+def worker_memory(vec_env):
+    """Resident and proportional set size of every worker of a SubprocVecEnv in MB (Linux only).
+
+    The proportional set size splits pages shared between processes over those processes, so it shows how much
+    memory a worker really costs when its pages are shared copy-on-write.
+    """
+    memory = []
+    for process in vec_env.processes:
+        rss = pss = None
+        with open(f"/proc/{process.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+        if os.path.exists(f"/proc/{process.pid}/smaps_rollup"):
+            with open(f"/proc/{process.pid}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        pss = int(line.split()[1]) / 1024
+        memory.append((rss, pss))
+    return memory